@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import html
 import logging
+import re
+import sqlite3
 import time
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, ChatMigrated, Forbidden, TelegramError
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, MessageHandler, 
+    AIORateLimiter, Application, CommandHandler, CallbackQueryHandler, MessageHandler, 
     ContextTypes, filters
 )
 
-from config import BOT_TOKEN, ADMIN_CHATS, DIRECTIONS, APPLICATION_FORM_SEND, APPLICATION_FORM_RECEIVE, OWNER_CHAT_ID
+from config import (
+    BOT_TOKEN, ADMIN_CHATS, DIRECTIONS, APPLICATION_FORM_SEND, APPLICATION_FORM_RECEIVE, OWNER_CHAT_ID,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET
+)
 from database import KPDatabase
 from models.rate_limiter import RateLimiter
+from models.ttl_cache import TTLCache
+from models.session_store import SessionStore
+from models.db_writer import DBWriter
+from models.callback_data import CallbackKind, FeedbackCallback, encode_callback, decode_callback
 from handlers.user_handler import UserHandler
 
 # Настройка логирования
@@ -40,61 +53,417 @@ class CallbackPrefixes:
     SEND_KP = 'send_kp_'
     KP_PAGE = 'kp_page_'
 
+# Поля заявки в админском сообщении бота: один проход регулярным выражением
+_APPLICATION_FIELDS_RE = re.compile(
+    r"НОВАЯ ЗАЯВКА \(ID: (?P<app_id>\d+)\)"
+    r"|🆔 ID:[ \t]*(?P<user_id>\d+)"
+    r"|Направление:[ \t]*(?P<direction>[^\n]+)"
+    r"|Фирма:[ \t]*(?P<company>[^\n]+)"
+)
+
+# Детальное представление заявки для админского чата
+_APPLICATION_TEMPLATE = """
+🏢 Фирма: {}
+🔢 ИНН: {}
+🏦 Банк: {}
+📊 НДС: {}%
+💰 Категория: {}
+📝 Назначение: {}
+💵 Сумма: {} руб.
+🔧 Тип: {}
+📄 Описание: {}
+"""
+
+# Админское сообщение о новой заявке (parse_mode='HTML'; подставляемые значения экранируются)
+_ADMIN_APPLICATION_TEMPLATE = """
+📋 НОВАЯ ЗАЯВКА (ID: {app_id})
+
+💸 <b>{operation}</b>
+
+👤 Пользователь: @{username}
+🆔 ID: {user_id}
+🏗️ Направление: {direction}
+
+{details}
+
+⏰ Время: {timestamp}
+"""
+
+# Уведомление об ответе клиента на КП (админу; владельцу - с заголовком)
+_FEEDBACK_TEMPLATE = """
+{result}
+
+👤 Пользователь: @{username}
+🆔 ID: {user_id}
+🏢 Фирма клиента: {company}
+🏗️ Направление: {direction}
+📋 Тип КП: {kp_type}
+📩 ID сообщения с КП: {kp_message_id}
+
+⏰ Время: {timestamp}
+"""
+
+# Справка по командам админа
+_ADMIN_HELP_TEXT = """
+🔧 ДОСТУПНЫЕ КОМАНДЫ АДМИНА:
+
+👥 /users [страница] - Список всех пользователей (по 50)
+🆕 /new_users [страница] - Новые пользователи за 7 дней (по 50)
+🚫 /block <user_id> - Заблокировать пользователя
+✅ /unblock <user_id> - Разблокировать пользователя
+
+📋 УПРАВЛЕНИЕ КП:
+➕ /add_kp - Добавить новое КП
+📝 /list_kp - Список всех КП
+✏️ /edit_kp <id> - Редактировать КП
+🗑️ /delete_kp <id> - Удалить КП
+
+❓ /help_admin - Эта справка
+"""
+
+# Ответ на команды владельца из чужого чата
+_OWNER_ONLY_TEXT = "❌ Доступ запрещен. Эта команда доступна только владельцу."
+_OWNER_ONLY_DETAILS_TEMPLATE = _OWNER_ONLY_TEXT + "\nВаш chat_id: {}\nОжидаемый: " + str(OWNER_CHAT_ID)
+
+# Подтверждение /delete_kp
+_KP_DELETED_TEMPLATE = (
+    "✅ КП успешно удалено!\n\n"
+    "🏢 Фирма: {company_name}\n"
+    "🔢 ИНН: {inn}\n"
+    "🏦 Банк: {bank}\n"
+    "📝 Назначение: {payment_purpose}\n"
+    "💰 Сумма: {min_amount:,} - {max_amount:,} руб.\n"
+    "📊 Комиссия: {commission_text}\n"
+    "🆔 ID: {id}"
+)
+
+# Строка КП в списке /list_kp
+_KP_ROW_TEMPLATE = (
+    "{i}. ID: {id}\n"
+    "   🏢 {company_name}\n"
+    "   🔢 ИНН: {inn}\n"
+    "   🏦 Банк: {bank}\n"
+    "   📝 Назначение: {payment_purpose}\n"
+    "   💰 Сумма: {min_amount:,} - {max_amount:,} руб.\n"
+    "   📊 Комиссия: {commission_text}\n\n"
+)
+
+# Сколько пользователей копится до внепланового сброса в БД
+_USERS_FLUSH_BATCH = 500
+
+# Как часто перечитывать набор заблокированных пользователей из БД, секунд
+_BLOCKED_IDS_REFRESH = 300
+
+# Статус пользователя в списках /users и /new_users (индекс - is_blocked)
+_USER_STATUS = ("✅ АКТИВЕН", "🚫 ЗАБЛОКИРОВАН")
+_NO_USERNAME = "Без username"
+
+# Пользователей на одной странице /users и /new_users
+_USERS_PAGE_SIZE = 50
+
+# Названия направлений, готовые для подстановки в HTML
+_DIRECTION_NAMES_HTML = {key: html.escape(name) for key, name in DIRECTIONS.items()}
+
+# Тип операции для админа: send - клиент платит, остальное - платим на клиента
+_OPERATION_TEXTS = {'send': "КЛИЕНТ ПЛАТИТ", 'receive': "ПЛАТИМ НА КЛИЕНТА"}
+
+# Подтверждение клиенту с уже подставленными направлением и операцией:
+# (direction, operation) -> текст
+_APPLICATION_CONFIRMATIONS = {
+    (direction, operation): (
+        f"✅ Заявка отправлена в направление '{name}'!\n\n"
+        f"💸 Тип операции: {operation_text}\n\n"
+        "⏳ Ожидайте ответа от администратора."
+    )
+    for direction, name in DIRECTIONS.items()
+    for operation, operation_text in _OPERATION_TEXTS.items()
+}
+
+# Админские чаты: chat_id -> направление (если чат указан дважды, берется первое)
+_CHAT_TO_DIRECTION: Dict[int, str] = {
+    chat_id: direction for direction, chat_id in reversed(list(ADMIN_CHATS.items())) if chat_id
+}
+_ADMIN_CHAT_IDS = frozenset(_CHAT_TO_DIRECTION)
+
+# Название направления -> ключ
+_DIRECTION_BY_NAME = {name: key for key, name in DIRECTIONS.items()}
+
+
+# Последняя отформатированная секунда: [unix-время, строка]
+_TIMESTAMP_CACHE: List[Any] = [0, ""]
+
+
+def _now_str() -> str:
+    """Текущее локальное время 'YYYY-MM-DD HH:MM:SS' (форматируется раз в секунду)"""
+    now = int(time.time())
+    if now != _TIMESTAMP_CACHE[0]:
+        _TIMESTAMP_CACHE[0] = now
+        _TIMESTAMP_CACHE[1] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+    return _TIMESTAMP_CACHE[1]
+
+
+def _parse_application_message(text: str) -> Dict[str, str]:
+    """Извлекает из сообщения с заявкой ID заявки, ID пользователя, направление и фирму"""
+    fields: Dict[str, str] = {}
+    for match in _APPLICATION_FIELDS_RE.finditer(text or ''):
+        name = match.lastgroup
+        fields.setdefault(name, match.group(name).strip())
+    return fields
+
 class ApplicationBot:
     def __init__(self) -> None:
-        self.user_states: Dict[int, Dict[str, Any]] = {}
-        self.rate_limiter = RateLimiter(max_requests=15, time_window=60)
-        self.user_applications: Dict[int, Dict[str, Any]] = {}
-        self.admin_states: Dict[int, Dict[str, Any]] = {}
         self.db = KPDatabase()
+        # Очередь записи в БД: пишет пачками в отдельном потоке
+        self.db_writer = DBWriter(self.db)
+        # Потоки для чтения из БД, чтобы запросы не блокировали event loop
+        # (WAL позволяет читать параллельно; запись идет только через db_writer)
+        self._db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db-reader')
+        self.rate_limiter = RateLimiter(max_requests=15, time_window=60)
+        
+        # Состояния хранятся в БД, чтобы переживать перезапуск бота (пишутся через db_writer)
+        self.user_states = SessionStore(self.db, 'user_state', ttl=1800, writer=self.db_writer)
+        self.user_applications = SessionStore(self.db, 'user_application', ttl=86400, writer=self.db_writer)
+        self.admin_states = SessionStore(self.db, 'admin_state', ttl=1800, writer=self.db_writer)
+        # Сессии читаются один раз при запуске: дальше промах кэша означает отсутствие
+        # сессии, и обработчики не ходят в БД из event loop
+        for store in (self.user_states, self.user_applications, self.admin_states):
+            store.load()
         
         self.user_handler = UserHandler(self.db, self.user_states, self.user_applications)
+        
+        # Заблокированные пользователи целиком в памяти, чтобы не ходить в БД на каждое обновление.
+        # Набор перечитывается раз в _BLOCKED_IDS_REFRESH секунд, /block и /unblock правят его сразу
+        self._blocked_ids = self.db.get_blocked_user_ids() or set()
+        self._blocked_loaded_at = time.monotonic()
+        self._blocked_version = 0
+        
+        # Короткий кэш страниц готовых КП: (direction, limit, offset) -> список КП
+        self._offers_cache = TTLCache(ttl=10, maxsize=1000)
+        # Недавно обработанные нажатия (user_id, callback_data) для защиты от двойного тапа
+        self._recent_callbacks = TTLCache(ttl=5, maxsize=1024)
+        
+        # Готовые КП по id и заявки по (admin_message_id, admin_chat_id)
+        self._offer_cache = TTLCache(ttl=300, maxsize=512)
+        self._application_cache = TTLCache(ttl=300, maxsize=512)
+        # Страницы /users и /new_users по (days, page): админы часто повторяют команду.
+        # Кэшируются только отдельные страницы, не весь список
+        self._admin_query_cache = TTLCache(ttl=30, maxsize=8)
+        # Загрузки страниц КП в процессе: одновременные запросы ждут один SELECT
+        self._offers_loading: Dict[tuple, asyncio.Future] = {}
+        
+        # Пользователи, ожидающие записи в БД (сбрасываются пачкой раз в 30 секунд)
+        self._dirty_users: Dict[int, Dict[str, Any]] = {}
     
+        # Обработчики inline кнопок по первому токену callback_data
+        self._callback_handlers = {
+            'restart': self.user_handler.start,
+            'operation': self.user_handler.handle_operation_selection,  # operation_
+            'direction': self.user_handler.handle_direction_selection,  # direction_
+            'feedback': self.handle_feedback,                           # feedback_
+            'fb': self.handle_feedback,                                 # fb_
+            'send': self.handle_send_kp,                                # send_kp_
+            'kp': self.handle_kp_pagination,                            # kp_page_
+        }
+        # Обработчики упакованных кнопок (models/callback_data.py) по типу
+        self._packed_callback_handlers = {
+            CallbackKind.SEND_KP: self.handle_send_kp,
+            CallbackKind.KP_PAGE: self.handle_kp_pagination,
+            CallbackKind.FEEDBACK: self.handle_feedback,
+        }
+
+        # Bot приложения (задается при запуске ежедневной очистки)
+        self._bot: Optional[Bot] = None
+        
+        # Команды админских чатов: команда -> обработчик(update, context, admin_direction)
+        self._admin_commands = {
+            '/help_admin': self._handle_help_command,
+            '/users': self._handle_users_command,
+            '/new_users': self._handle_new_users_command,
+            '/block': self._handle_block_command,
+            '/unblock': self._handle_unblock_command,
+            '/add_kp': self._handle_add_kp_command,
+            '/list_kp': self._handle_list_kp_command,
+            '/edit_kp': self._handle_edit_kp_command,
+            '/delete_kp': self._handle_delete_kp_command,
+            '/stats': self._handle_stats_command,
+            '/db_stats': self._handle_db_stats_command,
+            '/cleanup_db': self._handle_cleanup_db_command,
+        }
+        
         # Флаг для запуска ежедневной очистки
         self._cleanup_task = None
+        self._users_flush_task = None
     
-    def start_daily_cleanup(self) -> None:
+    def start_daily_cleanup(self, bot: Bot) -> None:
         """Запускает ежедневную очистку БД (вызывается после запуска event loop)"""
+        # Используем Bot приложения и его пул соединений
+        self._bot = bot
+        
         async def daily_cleanup():
             while True:
                 try:
-                    # Ждем до следующего дня в 02:00
-                    await asyncio.sleep(3600)  # Проверяем каждый час
+                    # Спим ровно до следующих 02:00 по локальному времени
+                    now = datetime.now()
+                    target = now.replace(hour=2, minute=0, second=0, microsecond=0)
+                    if target <= now:
+                        target += timedelta(days=1)
+                    await asyncio.sleep((target - now).total_seconds())
                     
-                    current_hour = time.localtime().tm_hour
-                    if current_hour == 2:  # 02:00
-                        logger.info("Starting daily database cleanup...")
-                        cleanup_result = self.db.cleanup_old_data()
-                        logger.info(f"Daily cleanup completed: {cleanup_result}")
-                        
-                        # Уведомляем владельца о очистке
-                        if OWNER_CHAT_ID:
-                            try:
-                                from telegram import Bot
-                                bot = Bot(token=BOT_TOKEN)
-                                await bot.send_message(
-                                    chat_id=OWNER_CHAT_ID,
-                                    text=f"Ежедневная очистка БД завершена:\n"
-                                         f"• Удалено уведомлений: {cleanup_result['notifications_deleted']}\n"
-                                         f"• Удалено отрицательных отзывов: {cleanup_result['feedback_no_deleted']}"
-                                )
-                            except Exception as e:
-                                logger.error(f"Error sending cleanup notification: {e}")
-                        
-                        # Ждем 23 часа до следующей проверки
-                        await asyncio.sleep(82800)
+                    logger.info("Starting daily database cleanup...")
+                    cleanup_result = await self._db(self.db.cleanup_old_data)
+                    logger.info("Daily cleanup completed: %s", cleanup_result)
+                    
+                    sessions_deleted = await self._db(self.db.cleanup_expired_sessions)
+                    logger.info("Expired sessions deleted: %s", sessions_deleted)
+                    
+                    # Уведомляем владельца о очистке
+                    if OWNER_CHAT_ID:
+                        try:
+                            await self._bot.send_message(
+                                chat_id=OWNER_CHAT_ID,
+                                text=f"Ежедневная очистка БД завершена:\n"
+                                     f"• Удалено уведомлений: {cleanup_result['notifications_deleted']}\n"
+                                     f"• Удалено отрицательных отзывов: {cleanup_result['feedback_no_deleted']}"
+                            )
+                        except TelegramError as e:
+                            logger.error("Error sending cleanup notification: %s", e)
+                    
+                    # Не запускаем очистку повторно в ту же минуту
+                    await asyncio.sleep(60)
                         
-                except Exception as e:
-                    logger.error(f"Error in daily cleanup: {e}")
+                except sqlite3.Error:
+                    logger.exception("Database error in daily cleanup")
                     await asyncio.sleep(3600)  # Ждем час при ошибке
+                except Exception:
+                    # Фоновая задача не должна умирать от неожиданной ошибки
+                    logger.exception("Unexpected error in daily cleanup")
+                    await asyncio.sleep(3600)
         
         # Запускаем задачу в фоне
         self._cleanup_task = asyncio.create_task(daily_cleanup())
     
+    def start_users_flush(self) -> None:
+        """Запускает периодическую запись активности пользователей в БД"""
+        async def users_flush():
+            while True:
+                await asyncio.sleep(30)
+                try:
+                    self.flush_users()
+                except Exception as e:
+                    logger.error("Error flushing users: %s", e)
+        
+        self._users_flush_task = asyncio.create_task(users_flush())
+    
+    def flush_users(self) -> None:
+        """Ставит накопленные данные пользователей в очередь записи одной пачкой"""
+        if not self._dirty_users:
+            return
+        
+        users, self._dirty_users = list(self._dirty_users.values()), {}
+        self.db_writer.post(self.db.add_or_update_users, users)
+    
+    def _flush_user(self, user_id: int) -> None:
+        """Ставит в очередь записи отложенные данные одного пользователя"""
+        pending = self._dirty_users.pop(user_id, None)
+        if pending is not None:
+            self.db_writer.post(self.db.add_or_update_users, [pending])
+    
+    async def shutdown(self) -> None:
+        """Дописывает накопленные данные в БД и освобождает потоки"""
+        self.flush_users()
+        await self.db_writer.stop()
+        self._db_executor.shutdown(wait=True)
+        self.db.close()
+    
+    def _track_user(self, user) -> None:
+        """Запоминает пользователя для отложенной записи в БД"""
+        self._dirty_users[user.id] = {
+            'user_id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name
+        }
+        
+        # Не копим слишком большую пачку до следующего планового сброса
+        if len(self._dirty_users) >= _USERS_FLUSH_BATCH:
+            self.flush_users()
+    
+    async def _db(self, fn, *args: Any) -> Any:
+        """Выполняет синхронный запрос к БД в отдельном потоке"""
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, fn, *args)
+    
+    async def _is_user_blocked(self, user_id: int) -> bool:
+        """Проверяет блокировку пользователя по набору в памяти"""
+        if time.monotonic() - self._blocked_loaded_at > _BLOCKED_IDS_REFRESH:
+            await self._refresh_blocked_ids()
+        return user_id in self._blocked_ids
+    
+    async def _refresh_blocked_ids(self) -> None:
+        # Отмечаем время заранее, чтобы параллельные обновления не перечитывали набор
+        self._blocked_loaded_at = time.monotonic()
+        version = self._blocked_version
+        
+        blocked_ids = await self._db(self.db.get_blocked_user_ids)
+        # Набор мог измениться через /block или /unblock, пока шел запрос
+        if blocked_ids is not None and version == self._blocked_version:
+            self._blocked_ids = blocked_ids
+    
+    def _set_blocked(self, user_id: int, is_blocked: bool) -> None:
+        """Обновляет набор заблокированных после /block или /unblock"""
+        if is_blocked:
+            self._blocked_ids.add(user_id)
+        else:
+            self._blocked_ids.discard(user_id)
+        self._blocked_version += 1
+    
+    async def _get_ready_offers(self, direction: str, limit: int = 5, offset: int = 0) -> List[Dict[str, Any]]:
+        """Возвращает страницу готовых КП с учетом кэша"""
+        key = (direction, limit, offset)
+        offers = self._offers_cache.get(key)
+        if offers is not None:
+            return offers
+        
+        # Если страница уже загружается, ждем тот же запрос
+        loading = self._offers_loading.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load_ready_offers(key))
+            self._offers_loading[key] = loading
+            loading.add_done_callback(lambda _: self._offers_loading.pop(key, None))
+        return await asyncio.shield(loading)
+    
+    async def _load_ready_offers(self, key: tuple) -> List[Dict[str, Any]]:
+        offers = await self._db(self.db.get_ready_offers_by_direction, *key)
+        self._offers_cache.set(key, offers)
+        return offers
+    
+    async def _get_ready_offer(self, offer_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает готовое КП по ID с учетом кэша"""
+        offer = self._offer_cache.get(offer_id)
+        if offer is None:
+            offer = await self._db(self.db.get_ready_offer_by_id, offer_id)
+            if offer:
+                self._offer_cache.set(offer_id, offer)
+        return offer
+    
+    async def _get_application_by_admin_message(self, admin_message_id: int, admin_chat_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает заявку по админскому сообщению с учетом кэша (кэшируются только найденные)"""
+        key = (admin_message_id, admin_chat_id)
+        app_data = self._application_cache.get(key)
+        if app_data is None:
+            app_data = await self._db(self.db.get_client_application_by_admin_message, admin_message_id, admin_chat_id)
+            if app_data:
+                self._application_cache.set(key, app_data)
+        return app_data
+    
+    def _invalidate_offer(self, offer_id: Optional[int] = None) -> None:
+        """Сбрасывает кэши КП после добавления, изменения или удаления"""
+        self._offers_cache.clear()
+        if offer_id is not None:
+            self._offer_cache.pop(offer_id)
+    
     def _validate_user_state(self, user_id: int, expected_state: str = UserStates.WAITING_APPLICATION) -> bool:
         """Проверяет состояние пользователя"""
-        return (user_id in self.user_states and 
-                self.user_states[user_id].get('state') == expected_state)
+        return self.user_states.get(user_id, {}).get('state') == expected_state
     
     async def _send_error_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message: str) -> None:
         """Отправляет сообщение об ошибке"""
@@ -124,18 +493,12 @@ class ApplicationBot:
         user_id = query.from_user.id
         
         # Проверяем блокировку пользователя
-        if self.db.is_user_blocked(user_id):
+        if await self._is_user_blocked(user_id):
             await query.answer("❌ Вы заблокированы и не можете использовать бота.", show_alert=True)
             return
         
         # Обновляем информацию о пользователе
-        user_data = {
-            'user_id': user_id,
-            'username': query.from_user.username,
-            'first_name': query.from_user.first_name,
-            'last_name': query.from_user.last_name
-        }
-        self.db.add_or_update_user(user_data)
+        self._track_user(query.from_user)
         
         # Rate limiting
         if not self.rate_limiter.is_allowed(user_id):
@@ -144,56 +507,29 @@ class ApplicationBot:
             return
         
         await query.answer()
-        
-        # Обработка callback'ов
-        if query.data == "restart":
-            await self.user_handler.start(update, context)
-        elif query.data.startswith(CallbackPrefixes.OPERATION):
-            await self.user_handler.handle_operation_selection(update, context)
-        elif query.data.startswith(CallbackPrefixes.DIRECTION):
-            await self.user_handler.handle_direction_selection(update, context)
-        elif query.data.startswith(CallbackPrefixes.FEEDBACK) or query.data.startswith(CallbackPrefixes.FEEDBACK_SHORT):
-            await self.handle_feedback(update, context)
-        elif query.data.startswith(CallbackPrefixes.SEND_KP):
-            await self.handle_send_kp(update, context)
-        elif query.data.startswith(CallbackPrefixes.KP_PAGE):
-            await self.handle_kp_pagination(update, context)
+
+        # Упакованные кнопки: обработчик выбирается по типу из payload
+        payload = decode_callback(query.data)
+        if payload is not None:
+            handler = self._packed_callback_handlers.get(payload['kind'])
+            if handler:
+                await handler(update, context, payload)
+            return
+
+        # Старые строковые кнопки: ищем обработчик по первому токену callback_data
+        handler = self._callback_handlers.get(query.data.split('_', 1)[0])
+        if handler:
+            await handler(update, context)
     
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработка текстовых сообщений"""
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
         
-        # Проверяем блокировку пользователя
-        if self.db.is_user_blocked(user_id):
-            await update.message.reply_text("❌ Вы заблокированы и не можете использовать бота.")
-            return
-        
-        # Обновляем информацию о пользователе
-        user_data = {
-            'user_id': user_id,
-            'username': update.effective_user.username,
-            'first_name': update.effective_user.first_name,
-            'last_name': update.effective_user.last_name
-        }
-        self.db.add_or_update_user(user_data)
-        
-        # Rate limiting
-        if not self.rate_limiter.is_allowed(user_id):
-            remaining_time = self.rate_limiter.get_remaining_time(user_id)
-            await update.message.reply_text(
-                f"⏳ Слишком много запросов. Попробуйте через {remaining_time} секунд."
-            )
-            return
-        
-        # Проверяем, это админская команда
-        if update.message.text.startswith('/'):
-            await self.handle_admin_command(update, context)
-            return
-        
-        # Проверяем, это админский чат
-        if str(chat_id) in [str(chat_id_config) for chat_id_config in ADMIN_CHATS.values()]:
-            logger.info(f"This is admin chat {chat_id}")
+        # Админский чат: админы не учитываются как пользователи бота,
+        # поэтому блокировку, учет и rate limiting пропускаем
+        if chat_id in _ADMIN_CHAT_IDS:
+            logger.debug("This is admin chat %s", chat_id)
             
             # Проверяем состояние админа для добавления/редактирования КП
             if user_id in self.admin_states:
@@ -202,13 +538,29 @@ class ApplicationBot:
             
             # Проверяем ответ на сообщение бота
             if update.message.reply_to_message and update.message.reply_to_message.from_user.is_bot:
-                logger.info(f"Admin reply to bot message - processing for forwarding")
+                logger.debug("Admin reply to bot message - processing for forwarding")
                 await self.handle_admin_response(update, context)
                 return
         
             # Любое другое сообщение в админском чате игнорируем
             return
         
+        # Проверяем блокировку пользователя
+        if await self._is_user_blocked(user_id):
+            await update.message.reply_text("❌ Вы заблокированы и не можете использовать бота.")
+            return
+        
+        # Обновляем информацию о пользователе
+        self._track_user(update.effective_user)
+        
+        # Rate limiting
+        if not self.rate_limiter.is_allowed(user_id):
+            remaining_time = self.rate_limiter.get_remaining_time(user_id)
+            await update.message.reply_text(
+                f"⏳ Слишком много запросов. Попробуйте через {remaining_time} секунд."
+            )
+            return
+        
         # Обработка заявок от пользователей
         await self.process_application(update, context)
     
@@ -226,11 +578,11 @@ class ApplicationBot:
         user_state = self.user_states[user_id]
         direction = user_state['direction']
         operation = user_state.get('operation', 'send')
+        # Неизвестный тип операции показывается как "платим на клиента",
+        # но в заявку и в БД записывается как есть
+        template_operation = operation if operation in _OPERATION_TEXTS else 'receive'
         application_text = update.message.text.strip()
         
-        # Определяем тип операции для админа
-        operation_text = "КЛИЕНТ ПЛАТИТ" if operation == 'send' else "ПЛАТИМ НА КЛИЕНТА"
-        
         # Сохраняем заявку для валидации
         self.user_applications[user_id] = {
             'direction': direction,
@@ -240,74 +592,67 @@ class ApplicationBot:
             'admin_chat_id': ADMIN_CHATS[direction]
         }
         
-        # Парсим заявку на строки
+        # Парсим заявку на строки (недостающие поля считаем пустыми)
         app_lines = application_text.split('\n')
+        company, inn, bank, nds, category, purpose, amount, equipment, description = (app_lines + [''] * 9)[:9]
         
         # Формируем детальное сообщение
         if len(app_lines) >= 9:
-            description = app_lines[8] if len(app_lines) > 8 else "Не указано"
-            detailed_app = f"""
-🏢 Фирма: {app_lines[0] if len(app_lines) > 0 else ''}
-🔢 ИНН: {app_lines[1] if len(app_lines) > 1 else ''}
-🏦 Банк: {app_lines[2] if len(app_lines) > 2 else ''}
-📊 НДС: {app_lines[3] if len(app_lines) > 3 else ''}%
-💰 Категория: {app_lines[4] if len(app_lines) > 4 else ''}
-📝 Назначение: {app_lines[5] if len(app_lines) > 5 else ''}
-💵 Сумма: {app_lines[6] if len(app_lines) > 6 else ''} руб.
-🔧 Тип: {app_lines[7] if len(app_lines) > 7 else ''}
-📄 Описание: {description}
-"""
+            detailed_app = _APPLICATION_TEMPLATE.format(
+                company, inn, bank, nds, category, purpose, amount, equipment, description
+            )
         else:
+            description = "Не указано"
             detailed_app = application_text
         
         # Сохраняем заявку в БД
         application_data = {
             'user_id': user_id,
             'direction': direction,
-            'company_name': app_lines[0] if len(app_lines) > 0 else '',
-            'inn': app_lines[1] if len(app_lines) > 1 else '',
-            'bank': app_lines[2] if len(app_lines) > 2 else '',
-            'nds_rate': int(app_lines[3]) if len(app_lines) > 3 and app_lines[3].isdigit() else 0,
-            'category': app_lines[4] if len(app_lines) > 4 else '',
-            'payment_purpose': app_lines[5] if len(app_lines) > 5 else '',
-            'amount': int(app_lines[6]) if len(app_lines) > 6 and app_lines[6].isdigit() else 0,
-            'equipment_type': app_lines[7] if len(app_lines) > 7 else '',
+            'company_name': company,
+            'inn': inn,
+            'bank': bank,
+            'nds_rate': int(nds) if nds.isdigit() else 0,
+            'category': category,
+            'payment_purpose': purpose,
+            'amount': int(amount) if amount.isdigit() else 0,
+            'equipment_type': equipment,
             'description': description,
             'operation_type': operation
         }
         
-        app_id = self.db.add_client_application(application_data)
+        app_id = await self.db_writer.submit(self.db.add_client_application, application_data)
         
         # Отправляем заявку админу
-        admin_message = f"""
-📋 НОВАЯ ЗАЯВКА (ID: {app_id})
-
-💸 <b>{operation_text}</b>
-
-👤 Пользователь: @{update.effective_user.username or update.effective_user.first_name}
-🆔 ID: {user_id}
-🏗️ Направление: {DIRECTIONS[direction]}
-
-{detailed_app}
-
-⏰ Время: {time.strftime('%Y-%m-%d %H:%M:%S')}
-        """
+        admin_message = _ADMIN_APPLICATION_TEMPLATE.format_map({
+            'app_id': app_id,
+            'operation': _OPERATION_TEXTS[template_operation],
+            'direction': _DIRECTION_NAMES_HTML[direction],
+            'username': html.escape(update.effective_user.username or update.effective_user.first_name or ''),
+            'user_id': user_id,
+            'details': html.escape(detailed_app, quote=False),
+            'timestamp': _now_str()
+        })
         
         try:
             # Получаем готовые КП для данного направления (первые 5)
-            ready_offers = self.db.get_ready_offers_by_direction(direction, limit=5, offset=0)
+            ready_offers = await self._get_ready_offers(direction, limit=5, offset=0)
             
             # Создаем кнопки с готовыми КП
-            keyboard = []
-            for offer in ready_offers:
-                button_text = f"{offer['company_name'][:20]} | {offer['payment_purpose'][:15]}"
-                callback_data = f"send_kp_{offer['id']}_{user_id}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+            keyboard = [
+                [InlineKeyboardButton(
+                    f"{offer['company_name'][:20]} | {offer['payment_purpose'][:15]}",
+                    callback_data=encode_callback(CallbackKind.SEND_KP, offer_id=offer['id'], user_id=user_id)
+                )]
+                for offer in ready_offers
+            ]
             
             # Добавляем кнопки пагинации если КП больше 5
             if len(ready_offers) == 5:
                 keyboard.append([
-                    InlineKeyboardButton("➡️ Далее", callback_data=f"kp_page_1_{direction}_{user_id}")
+                    InlineKeyboardButton("➡️ Далее", callback_data=encode_callback(
+                        CallbackKind.KP_PAGE, page=1, direction=direction, user_id=user_id
+                    ))
                 ])
             
             reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
@@ -323,22 +668,19 @@ class ApplicationBot:
             
             # Сохраняем информацию об админском сообщении в БД
             if app_id > 0:
-                self.db.update_client_application_admin_info(
+                self.db_writer.post(
+                    self.db.update_client_application_admin_info,
                     app_id, admin_msg.message_id, str(ADMIN_CHATS[direction])
-            )
+                )
             
             # Отправляем подтверждение пользователю
-            await update.message.reply_text(
-                f"✅ Заявка отправлена в направление '{DIRECTIONS[direction]}'!\n\n"
-                f"💸 Тип операции: {operation_text}\n\n"
-                "⏳ Ожидайте ответа от администратора."
-            )
+            await update.message.reply_text(_APPLICATION_CONFIRMATIONS[direction, template_operation])
             
             # Очищаем состояние пользователя
             del self.user_states[user_id]
             
-        except Exception as e:
-            logger.error(f"Error sending application: {e}")
+        except TelegramError as e:
+            logger.error("Error sending application %s to admin chat: %s", app_id, e)
             await update.message.reply_text(
                 "❌ Ошибка отправки заявки. Попробуйте позже."
             )
@@ -356,39 +698,20 @@ class ApplicationBot:
             return
         
         try:
-            # Ищем строку с ID пользователя (не ID заявки)
-            user_id_line = None
-            for line in bot_message_text.split('\n'):
-                if '🆔 ID:' in line and 'НОВАЯ ЗАЯВКА' not in line:
-                    user_id_line = line
-                    break
-            
-            if not user_id_line:
+            fields = _parse_application_message(bot_message_text)
+            
+            # ID пользователя из строки "🆔 ID: {user_id}" (не ID заявки)
+            if 'user_id' not in fields:
                 logger.error("Could not find user ID in message")
                 return
-                
-            # Извлекаем user_id из строки "🆔 ID: {user_id}"
-            id_part = user_id_line.split('🆔 ID:')[1].strip()
-            user_id = int(id_part)
-            
-            # Извлекаем направление из сообщения
-            direction_line = [line for line in bot_message_text.split('\n') if 'Направление:' in line]
-            direction = None
-            if direction_line:
-                direction_text = direction_line[0].split('Направление:')[1].strip()
-                # Находим ключ направления по названию
-                for dir_key, dir_name in DIRECTIONS.items():
-                    if dir_name == direction_text:
-                        direction = dir_key
-                        break
+            user_id = int(fields['user_id'])
+            
+            # Находим ключ направления по названию
+            direction = _DIRECTION_BY_NAME.get(fields.get('direction'))
             
             # Если направление не найдено, определяем его по админскому чату
             if not direction:
-                admin_chat_id = update.effective_chat.id
-                for dir_key, chat_id_config in ADMIN_CHATS.items():
-                    if str(admin_chat_id) == str(chat_id_config):
-                        direction = dir_key
-                        break
+                direction = _CHAT_TO_DIRECTION.get(update.effective_chat.id)
             
             # Получаем admin_chat_id текущего чата
             admin_chat_id = update.effective_chat.id
@@ -397,35 +720,20 @@ class ApplicationBot:
             kp_message_id = update.message.message_id
             kp_id = f"{admin_chat_id}_{kp_message_id}"
             
-            # Получаем информацию о заявке клиента из сообщения
-            client_info = "Неизвестная заявка"
-            if reply_to_message and reply_to_message.text:
-                lines = reply_to_message.text.split('\n')
-                
-                # Ищем название фирмы клиента в сообщении
-                for i, line in enumerate(lines):
-                    # Ищем строку с фирмой (обычно это строка после "НОВАЯ ЗАЯВКА")
-                    if 'Фирма:' in line:
-                        client_info = line.split('Фирма:')[1].strip()
-                        break
-                    elif 'НОВАЯ ЗАЯВКА' in line and i + 1 < len(lines):
-                        # Берем следующую строку после "НОВАЯ ЗАЯВКА" - это обычно название фирмы
-                        next_line = lines[i + 1].strip()
-                        if next_line and not next_line.startswith('💸') and not next_line.startswith('👤'):
-                            client_info = next_line
-                            break
-                
-                # Очищаем от проблемных символов для callback_data
-                client_info = client_info.replace(' ', '_').replace('"', '').replace("'", '').replace('\n', '').replace('\r', '').replace('📋', '').replace('🏢', '').strip()[:15]
-                logger.info(f"Parsed client info: {client_info}")
+            # Получаем название фирмы клиента из сообщения
+            # (очистка не нужна: encode_callback сам обрезает его под лимит callback_data)
+            client_info = fields.get('company', "Неизвестная заявка")
+            logger.info("Parsed client info: %s", client_info)
             
-            # Создаем inline кнопки для обратной связи (краткий формат)
-            client_short = client_info[:5] if client_info else "unk"
-            direction_for_feedback = direction if direction else "unknown"
+            # Создаем inline кнопки для обратной связи (ручное КП: offer_id не задан)
+            feedback_fields = dict(
+                admin_chat_id=admin_chat_id, kp_message_id=kp_message_id,
+                offer_id=None, direction=direction, client=client_info
+            )
             keyboard = [
                 [
-                    InlineKeyboardButton("✅ Счёт подходит", callback_data=f"fb_yes_{admin_chat_id}_{kp_message_id}_none_{direction_for_feedback}_{client_short}"),
-                    InlineKeyboardButton("❌ Счёт не подходит", callback_data=f"fb_no_{admin_chat_id}_{kp_message_id}_none_{direction_for_feedback}_{client_short}")
+                    InlineKeyboardButton("✅ Счёт подходит", callback_data=encode_callback(CallbackKind.FEEDBACK, feedback_type='yes', **feedback_fields)),
+                    InlineKeyboardButton("❌ Счёт не подходит", callback_data=encode_callback(CallbackKind.FEEDBACK, feedback_type='no', **feedback_fields))
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -438,8 +746,8 @@ class ApplicationBot:
                     text=f"💬 Коммерческое предложение от администратора:\n\n{response_text}",
                     reply_markup=reply_markup
                 )
-            except Exception as send_error:
-                logger.error(f"Error sending message to user {user_id}: {send_error}")
+            except (Forbidden, BadRequest) as send_error:
+                logger.error("Error sending message to user %s: %s", user_id, send_error)
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text=f"❌ Не удалось отправить сообщение пользователю {user_id}. Возможно, пользователь заблокировал бота."
@@ -452,24 +760,29 @@ class ApplicationBot:
                 text=f"✅ КП отправлено пользователю {user_id}"
             )
             
-        except Exception as e:
-            logger.error(f"Error processing admin response: {e}")
+        except (TelegramError, ValueError) as e:
+            # ValueError - испорченный ID пользователя в тексте заявки
+            logger.error("Error processing admin response: %s", e)
+            await update.message.reply_text("❌ Ошибка обработки ответа")
     
-    async def handle_send_kp(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def handle_send_kp(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             payload: Optional[Dict[str, Any]] = None) -> None:
         """Отправляет выбранное КП клиенту"""
         query = update.callback_query
         
         try:
-            # Парсим callback_data: send_kp_{offer_id}_{user_id}
-            parts = self._parse_callback_data(query.data, 4)
-            if not parts:
-                await query.answer("❌ Неверный формат данных", show_alert=True)
-                return
-            offer_id = int(parts[2])
-            client_user_id = int(parts[3])
+            if payload is None:
+                # Старый формат callback_data: send_kp_{offer_id}_{user_id}
+                parts = self._parse_callback_data(query.data, 4)
+                if not parts:
+                    await query.answer("❌ Неверный формат данных", show_alert=True)
+                    return
+                payload = {'offer_id': int(parts[2]), 'user_id': int(parts[3])}
+            offer_id = payload['offer_id']
+            client_user_id = payload['user_id']
             
             # Получаем КП из БД
-            offer = self.db.get_ready_offer_by_id(offer_id)
+            offer = await self._get_ready_offer(offer_id)
             
             if not offer:
                 await query.answer("❌ КП не найдено", show_alert=True)
@@ -497,83 +810,35 @@ class ApplicationBot:
             client_info = "Неизвестная заявка"
             direction_from_db = offer['direction']
             
-            # Пытаемся найти заявку клиента по admin_message_id
-            # Сначала ищем в reply_to_message
-            admin_message_id = None
-            app_data = None
+            # Заявка клиента: кнопки КП висят на сообщении с заявкой (или на ответе на него)
+            source_message = query.message.reply_to_message or query.message
+            kp_message_id = source_message.message_id
             
             try:
-                # Если есть reply_to_message, используем его ID
-                if query.message.reply_to_message:
-                    admin_message_id = query.message.reply_to_message.message_id
-                    app_data = self.db.get_client_application_by_admin_message(admin_message_id, str(admin_chat_id))
-                
-                # Если не найдено, пробуем найти по ID заявки в тексте
-                if not app_data and query.message.reply_to_message:
-                    original_message = query.message.reply_to_message
-                    if original_message and original_message.text:
-                        lines = original_message.text.split('\n')
-                        for line in lines:
-                            if 'НОВАЯ ЗАЯВКА (ID:' in line:
-                                try:
-                                    # Извлекаем ID из строки типа "НОВАЯ ЗАЯВКА (ID: 3)"
-                                    id_part = line.split('ID:')[1].strip()
-                                    app_id = int(id_part.split(')')[0].strip())
-                                    app_data = self.db.get_client_application_by_id(app_id)
-                                    if app_data:
-                                        admin_message_id = original_message.message_id
-                                        break
-                                except (ValueError, IndexError):
-                                    pass
+                # Ищем заявку по ID админского сообщения, затем по ID заявки в тексте (один SELECT на шаг)
+                app_data = await self._get_application_by_admin_message(kp_message_id, str(admin_chat_id))
+                if not app_data and source_message.text:
+                    fields = _parse_application_message(source_message.text)
+                    if 'app_id' in fields:
+                        app_data = await self._db(self.db.get_client_application_by_id, int(fields['app_id']))
+                    # Fallback: название фирмы из текста
+                    if not app_data and 'company' in fields:
+                        client_info = fields['company']
                 
                 if app_data:
                     client_info = app_data['company_name']
                     direction_from_db = app_data['direction']
-                    logger.info(f"Found application: {app_data['company_name']}, direction: {app_data['direction']}")
-                else:
-                    # Fallback: ищем в тексте сообщения
-                    original_message = query.message.reply_to_message
-                    if original_message and original_message.text:
-                        lines = original_message.text.split('\n')
-                        for line in lines:
-                            if 'НОВАЯ ЗАЯВКА (ID:' in line:
-                                try:
-                                    # Извлекаем ID из строки типа "НОВАЯ ЗАЯВКА (ID: 3)"
-                                    id_part = line.split('ID:')[1].strip()
-                                    app_id = int(id_part.split(')')[0].strip())
-                                    app_data = self.db.get_client_application_by_id(app_id)
-                                    if app_data:
-                                        client_info = app_data['company_name']
-                                        direction_from_db = app_data['direction']
-                                        break
-                                except (ValueError, IndexError):
-                                    pass
-                            
-                            # Fallback: ищем название фирмы в тексте
-                            if '🏢 Фирма:' in line:
-                                client_info = line.split('🏢 Фирма:')[1].strip()
-                                break
-                            elif 'Фирма:' in line and '🏢' in line:
-                                client_info = line.split('Фирма:')[1].strip()
-                                break
-            except Exception as e:
-                logger.error(f"Error getting application data: {e}")
-            
-            # Очищаем от проблемных символов для callback_data и ограничиваем длину
-            client_info = client_info.replace(' ', '_').replace('"', '').replace("'", '').replace('\n', '').replace('\r', '')[:8]
-            
-            # Создаем кнопки обратной связи (краткий формат)
-            # Сокращаем client_info до минимума
-            client_short = client_info[:5] if client_info else "unk"
-            
-            # Используем правильный admin_message_id или fallback на текущий message_id
-            kp_message_id = admin_message_id if admin_message_id else query.message.message_id
-            
-            # Логируем callback_data для отладки
-            callback_data_yes = f"fb_yes_{admin_chat_id}_{kp_message_id}_{offer_id}_{direction_from_db}_{client_short}"
-            callback_data_no = f"fb_no_{admin_chat_id}_{kp_message_id}_{offer_id}_{direction_from_db}_{client_short}"
-            logger.info(f"Creating callback_data: yes={callback_data_yes}")
-            logger.info(f"Creating callback_data: no={callback_data_no}")
+                    logger.info("Found application: %s, direction: %s", app_data['company_name'], app_data['direction'])
+            except sqlite3.Error as e:
+                logger.error("Error getting application data: %s", e)
+            
+            # Создаем кнопки обратной связи; название фирмы обрезается под лимит callback_data
+            feedback_fields = dict(
+                admin_chat_id=admin_chat_id, kp_message_id=kp_message_id,
+                offer_id=offer_id, direction=direction_from_db, client=client_info.strip()
+            )
+            callback_data_yes = encode_callback(CallbackKind.FEEDBACK, feedback_type='yes', **feedback_fields)
+            callback_data_no = encode_callback(CallbackKind.FEEDBACK, feedback_type='no', **feedback_fields)
             
             keyboard = [
                 [
@@ -590,54 +855,75 @@ class ApplicationBot:
                 reply_markup=reply_markup
             )
             
-            # Подтверждаем админу
-            await query.answer("✅ КП отправлено клиенту")
-            
-            # Отправляем подтверждение в админ чат (НЕ убираем кнопки, чтобы можно было отправлять повторно)
-            await context.bot.send_message(
-                chat_id=admin_chat_id,
-                text=f"✅ КП '{offer['company_name']}' отправлено пользователю {client_user_id}"
+            # Подтверждаем админу и отправляем подтверждение в админ чат параллельно
+            # (НЕ убираем кнопки, чтобы можно было отправлять повторно)
+            results = await asyncio.gather(
+                query.answer("✅ КП отправлено клиенту"),
+                context.bot.send_message(
+                    chat_id=admin_chat_id,
+                    text=f"✅ КП '{offer['company_name']}' отправлено пользователю {client_user_id}"
+                ),
+                return_exceptions=True
             )
-            
-        except Exception as e:
-            logger.error(f"Error sending offer: {e}")
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning("Error confirming offer %s to admin: %s", offer_id, result)
+            
+        except Forbidden as e:
+            logger.warning("Client %s blocked the bot: %s", client_user_id, e)
+            await query.answer("❌ Клиент заблокировал бота", show_alert=True)
+        except TelegramError as e:
+            logger.error("Error sending offer: %s", e)
             await query.answer("❌ Ошибка отправки КП", show_alert=True)
+        except (ValueError, KeyError, IndexError) as e:
+            # Испорченные callback_data или payload
+            logger.error("Error parsing send_kp callback %r: %s", query.data, e)
+            await query.answer("❌ Ошибка", show_alert=True)
     
-    async def handle_kp_pagination(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def handle_kp_pagination(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                   payload: Optional[Dict[str, Any]] = None) -> None:
         """Обрабатывает пагинацию КП"""
         query = update.callback_query
         
         try:
-            # Парсим callback_data: kp_page_{page}_{direction}_{user_id}
-            parts = self._parse_callback_data(query.data, 5)
-            if not parts:
-                await query.answer("❌ Неверный формат данных", show_alert=True)
-                return
-            page = int(parts[2])
-            direction = parts[3]
-            client_user_id = int(parts[4])
+            if payload is None:
+                # Старый формат callback_data: kp_page_{page}_{direction}_{user_id}
+                parts = self._parse_callback_data(query.data, 5)
+                if not parts:
+                    await query.answer("❌ Неверный формат данных", show_alert=True)
+                    return
+                payload = {'page': int(parts[2]), 'direction': parts[3], 'user_id': int(parts[4])}
+            page = payload['page']
+            direction = payload['direction']
+            client_user_id = payload['user_id']
             
             # Получаем КП для данной страницы
             offset = page * 5
-            ready_offers = self.db.get_ready_offers_by_direction(direction, limit=5, offset=offset)
+            ready_offers = await self._get_ready_offers(direction, limit=5, offset=offset)
             
             if not ready_offers:
                 await query.answer("Больше нет КП", show_alert=True)
                 return
             
             # Создаем кнопки с КП
-            keyboard = []
-            for offer in ready_offers:
-                button_text = f"{offer['company_name'][:20]} | {offer['payment_purpose'][:15]}"
-                callback_data = f"send_kp_{offer['id']}_{client_user_id}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+            keyboard = [
+                [InlineKeyboardButton(
+                    f"{offer['company_name'][:20]} | {offer['payment_purpose'][:15]}",
+                    callback_data=encode_callback(CallbackKind.SEND_KP, offer_id=offer['id'], user_id=client_user_id)
+                )]
+                for offer in ready_offers
+            ]
             
             # Добавляем кнопки навигации
             nav_buttons = []
             if page > 0:
-                nav_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"kp_page_{page-1}_{direction}_{client_user_id}"))
+                nav_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback(
+                    CallbackKind.KP_PAGE, page=page - 1, direction=direction, user_id=client_user_id
+                )))
             if len(ready_offers) == 5:
-                nav_buttons.append(InlineKeyboardButton("➡️ Далее", callback_data=f"kp_page_{page+1}_{direction}_{client_user_id}"))
+                nav_buttons.append(InlineKeyboardButton("➡️ Далее", callback_data=encode_callback(
+                    CallbackKind.KP_PAGE, page=page + 1, direction=direction, user_id=client_user_id
+                )))
             
             if nav_buttons:
                 keyboard.append(nav_buttons)
@@ -648,11 +934,20 @@ class ApplicationBot:
             await query.edit_message_reply_markup(reply_markup=reply_markup)
             await query.answer(f"Страница {page + 1}")
             
-        except Exception as e:
-            logger.error(f"Error in offer pagination: {e}")
+        except BadRequest as e:
+            # Повторное нажатие на ту же страницу: разметка не изменилась
+            if "not modified" in str(e):
+                await query.answer()
+                return
+            logger.error("Error in offer pagination: %s", e)
+            await query.answer("❌ Ошибка", show_alert=True)
+        except (TelegramError, ValueError, KeyError, IndexError) as e:
+            # Прочие ошибки Telegram и испорченные callback_data
+            logger.error("Error in offer pagination: %s", e)
             await query.answer("❌ Ошибка", show_alert=True)
     
-    async def handle_feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def handle_feedback(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                              payload: Optional[Dict[str, Any]] = None) -> None:
         """Обрабатывает обратную связь от клиента по КП"""
         query = update.callback_query
         user_id = query.from_user.id
@@ -660,52 +955,63 @@ class ApplicationBot:
         # Отвечаем на callback сразу, чтобы избежать таймаута
         await query.answer()
         
+        # Повторное нажатие той же кнопки (двойной тап) не обрабатываем
+        callback_key = (user_id, query.data)
+        if self._recent_callbacks.get(callback_key):
+            logger.info("Duplicate feedback callback from user %s, skipping", user_id)
+            return
+        self._recent_callbacks.set(callback_key, True)
+        
         # Логируем callback_data для отладки
-        logger.info(f"Feedback callback_data: {query.data}")
+        logger.debug("Feedback callback_data: %s", query.data)
         
-        # Парсим callback_data: fb_yes/no_{admin_chat_id}_{message_id}_{offer_id}_{direction}_{client_short}
         try:
-            parts = self._parse_callback_data(query.data, 7)
-            if not parts:
+            if payload is not None:
+                callback = FeedbackCallback.from_payload(payload)
+            else:
+                callback = FeedbackCallback.parse_legacy(query.data)
+            if callback is None:
                 await query.answer("❌ Неверный формат данных", show_alert=True)
                 return
-                
-            feedback_type = parts[1]  # yes или no
-            admin_chat_id = parts[2]
-            kp_message_id = parts[3]
-            offer_id = parts[4]
-            direction = parts[5]
-            client_short = parts[6] if len(parts) > 6 else "unk"
+            
+            feedback_type = callback.feedback_type  # yes или no
+            admin_chat_id = callback.admin_chat_id
+            kp_message_id = callback.kp_message_id
+            offer_id_int = callback.offer_id
+            offer_id = str(offer_id_int) if offer_id_int else "none"
+            direction = callback.direction
+            client_short = callback.client
             
             # Логируем распарсенные данные
-            logger.info(f"Parsed: admin_chat_id={admin_chat_id}, kp_message_id={kp_message_id}, offer_id={offer_id}, direction={direction}, client_short={client_short}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Parsed: admin_chat_id=%s, kp_message_id=%s, offer_id=%s, direction=%s, client_short=%s",
+                    admin_chat_id, kp_message_id, offer_id, direction, client_short
+                )
             
             # Получаем полную информацию о клиенте из БД
             client_info = "Неизвестная заявка"
             try:
                 # Пытаемся найти заявку по admin_message_id
-                app_data = self.db.get_client_application_by_admin_message(int(kp_message_id), admin_chat_id)
+                app_data = await self._get_application_by_admin_message(int(kp_message_id), admin_chat_id)
                 if app_data:
                     client_info = app_data['company_name']
                     direction = app_data['direction']  # Используем направление из БД
-                    logger.info(f"Found application in DB: {app_data['company_name']}, direction: {app_data['direction']}")
+                    logger.info("Found application in DB: %s, direction: %s", app_data['company_name'], app_data['direction'])
                 else:
-                    logger.warning(f"Заявка не найдена в БД для admin_message_id={kp_message_id}, admin_chat_id={admin_chat_id}")
+                    logger.warning("Заявка не найдена в БД для admin_message_id=%s, admin_chat_id=%s", kp_message_id, admin_chat_id)
                     # Fallback на сокращенное имя
                     client_info = client_short
             except Exception as e:
-                logger.error(f"Error searching application in DB: {e}")
+                logger.error("Error searching application in DB: %s", e)
                 client_info = client_short
             
             # Если направление неизвестно, определяем его по админскому чату
             if direction == "unknown" or not direction:
-                for dir_key, chat_id_config in ADMIN_CHATS.items():
-                    if chat_id_config and str(admin_chat_id) == str(chat_id_config):
-                        direction = dir_key
-                        break
+                direction = _CHAT_TO_DIRECTION.get(int(admin_chat_id), direction)
                 # Если все еще не найдено, логируем для отладки
                 if direction == "unknown" or not direction:
-                    logger.error(f"Direction not found for admin_chat_id: {admin_chat_id}, ADMIN_CHATS: {ADMIN_CHATS}")
+                    logger.error("Direction not found for admin_chat_id: %s, ADMIN_CHATS: %s", admin_chat_id, ADMIN_CHATS)
             
             kp_id = f"{admin_chat_id}_{kp_message_id}"
             if offer_id:
@@ -718,7 +1024,7 @@ class ApplicationBot:
                 'feedback_type': feedback_type,
                 'direction': direction or 'unknown'
             }
-            self.db.add_feedback(feedback_data)
+            self.db_writer.post(self.db.add_feedback, feedback_data)
             
             # Обновляем сообщение с КП, показываем выбор пользователя
             if feedback_type == 'yes':
@@ -746,10 +1052,10 @@ class ApplicationBot:
             
             # Определяем тип КП
             kp_type = "Ручное КП от админа"
-            if offer_id and offer_id != "none" and offer_id.isdigit():
+            if offer_id_int is not None:
                 try:
                     # Получаем данные КП из БД для отображения названия
-                    offer_data = self.db.get_ready_offer_by_id(int(offer_id))
+                    offer_data = await self._get_ready_offer(offer_id_int)
                     if offer_data:
                         # Формируем название как "компания | банк"
                         company_name = offer_data.get('company_name', 'Неизвестная компания')
@@ -758,223 +1064,193 @@ class ApplicationBot:
                     else:
                         kp_type = f"Готовое КП (ID: {offer_id})"
                 except Exception as e:
-                    logger.error(f"Error getting offer data: {e}")
+                    logger.error("Error getting offer data: %s", e)
                     kp_type = f"Готовое КП (ID: {offer_id})"
             
             # Определяем направление по admin_chat_id
-            admin_direction = None
-            for dir_key, chat_id in ADMIN_CHATS.items():
-                if str(admin_chat_id) == str(chat_id):
-                    admin_direction = dir_key
-                    break
+            admin_direction = _CHAT_TO_DIRECTION.get(int(admin_chat_id))
             
             # Используем направление из БД, если есть, иначе из admin_chat_id
             final_direction = direction if direction and direction != "unknown" else admin_direction
             
-            admin_notification = f"""
-{admin_feedback_text}
-
-👤 Пользователь: @{username}
-🆔 ID: {user_id}
-🏢 Фирма клиента: {client_info}
-🏗️ Направление: {DIRECTIONS.get(final_direction, 'Неизвестно')}
-📋 Тип КП: {kp_type}
-📩 ID сообщения с КП: {kp_message_id}
-
-⏰ Время: {time.strftime('%Y-%m-%d %H:%M:%S')}
-            """
-            
-            await context.bot.send_message(
-                chat_id=int(admin_chat_id),
-                text=admin_notification
+            admin_notification = _FEEDBACK_TEMPLATE.format(
+                result=admin_feedback_text,
+                username=username,
+                user_id=user_id,
+                company=client_info,
+                direction=DIRECTIONS.get(final_direction, 'Неизвестно'),
+                kp_type=kp_type,
+                kp_message_id=kp_message_id,
+                timestamp=_now_str()
             )
             
-            # Отправляем уведомление владельцу
+            # Уведомления админу и владельцу отправляем параллельно
+            sends = [context.bot.send_message(chat_id=int(admin_chat_id), text=admin_notification)]
             if OWNER_CHAT_ID:
-                owner_notification = f"""
-📊 УВЕДОМЛЕНИЕ ВЛАДЕЛЬЦУ
-
-{admin_feedback_text}
-👤 Пользователь: @{username}
-🆔 ID: {user_id}
-🏢 Фирма клиента: {client_info}
-🏗️ Направление: {DIRECTIONS.get(final_direction, 'Неизвестно')}
-📋 Тип КП: {kp_type}
-📩 ID сообщения с КП: {kp_message_id}
-⏰ Время: {time.strftime('%Y-%m-%d %H:%M:%S')}
-                """
-                
-                try:
-                    await context.bot.send_message(
-                        chat_id=OWNER_CHAT_ID,
-                        text=owner_notification,
-                        parse_mode='HTML'
-                    )
-                    
-                    # Сохраняем уведомление в БД
-                    notification_data = {
-                        'notification_type': 'feedback',
-                        'user_id': user_id,
-                        'application_id': None,  # TODO: связать с заявкой
-                        'offer_id': offer_id,
-                        'direction': direction,
-                        'company_name': client_info,
-                        'admin_chat_id': admin_chat_id,
-                        'admin_user_id': None,  # TODO: получить ID админа
-                        'feedback_type': feedback_type,
-                        'message': owner_notification
-                    }
-                    self.db.add_owner_notification(notification_data)
-                    
-                except Exception as e:
-                    logger.error(f"Error sending owner notification: {e}")
-                    # Если группа мигрировала, попробуем извлечь новый ID из ошибки
-                    if "migrated to supergroup" in str(e):
-                        try:
-                            # Извлекаем новый ID из сообщения об ошибке
-                            error_msg = str(e)
-                            if "New chat id:" in error_msg:
-                                new_chat_id = error_msg.split("New chat id:")[1].strip()
-                                await context.bot.send_message(
-                                    chat_id=new_chat_id,
-                                    text=owner_notification,
-                                    parse_mode='HTML'
-                                )
-                                logger.info(f"Notification sent to new supergroup: {new_chat_id}")
-                            else:
-                                logger.error(f"Failed to extract new ID from error: {error_msg}")
-                        except Exception as e2:
-                            logger.error(f"Error sending to new supergroup: {e2}")
+                owner_notification = "📊 УВЕДОМЛЕНИЕ ВЛАДЕЛЬЦУ\n" + admin_notification
+                notification_data = {
+                    'notification_type': 'feedback',
+                    'user_id': user_id,
+                    'application_id': None,  # TODO: связать с заявкой
+                    'offer_id': offer_id,
+                    'direction': direction,
+                    'company_name': client_info,
+                    'admin_chat_id': admin_chat_id,
+                    'admin_user_id': None,  # TODO: получить ID админа
+                    'feedback_type': feedback_type,
+                    'message': owner_notification
+                }
+                sends.append(self._send_owner_notification(context, owner_notification, notification_data))
+            
+            admin_result = (await asyncio.gather(*sends, return_exceptions=True))[0]
+            if isinstance(admin_result, Exception):
+                logger.error("Error sending feedback to admin chat %s: %s", admin_chat_id, admin_result)
             
             # query.answer() уже вызван в начале функции
             
         except Exception as e:
-            logger.error(f"Error processing feedback: {e}")
+            logger.error("Error processing feedback: %s", e)
             await query.answer("❌ Ошибка обработки ответа", show_alert=True)
     
+    async def _send_owner_notification(self, context: ContextTypes.DEFAULT_TYPE, text: str,
+                                       notification_data: Dict[str, Any]) -> None:
+        """Отправляет уведомление владельцу и сохраняет его в БД"""
+        try:
+            await context.bot.send_message(chat_id=OWNER_CHAT_ID, text=text)
+        except ChatMigrated as e:
+            # Группа владельца стала супергруппой: отправляем по новому ID
+            logger.error("Error sending owner notification: %s", e)
+            try:
+                await context.bot.send_message(chat_id=e.new_chat_id, text=text)
+                logger.info("Notification sent to new supergroup: %s", e.new_chat_id)
+            except TelegramError as e2:
+                logger.error("Error sending to new supergroup: %s", e2)
+            return
+        except TelegramError as e:
+            logger.error("Error sending owner notification: %s", e)
+            return
+        
+        # Сохраняем уведомление в БД
+        self.db_writer.post(self.db.add_owner_notification, notification_data)
+    
     async def handle_admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команд админа"""
-        message_text = update.message.text.lower()
         chat_id = update.effective_chat.id
         
         # Определяем направление для админского чата
-        is_admin_chat = False
-        admin_direction = None
-        for direction, chat_id_config in ADMIN_CHATS.items():
-            if str(chat_id) == str(chat_id_config):
-                is_admin_chat = True
-                admin_direction = direction
-                break
-        
-        if not is_admin_chat:
+        admin_direction = _CHAT_TO_DIRECTION.get(chat_id)
+        if admin_direction is None:
             return
         
-        logger.info(f"Processing admin command: {message_text} in chat {chat_id}")
-        
-        # Обработка команд
-        if message_text.startswith('/help_admin'):
-            help_text = """
-🔧 ДОСТУПНЫЕ КОМАНДЫ АДМИНА:
-
-👥 /users - Список всех пользователей
-🆕 /new_users - Новые пользователи (за 7 дней)
-🚫 /block <user_id> - Заблокировать пользователя
-✅ /unblock <user_id> - Разблокировать пользователя
-
-📋 УПРАВЛЕНИЕ КП:
-➕ /add_kp - Добавить новое КП
-📝 /list_kp - Список всех КП
-✏️ /edit_kp <id> - Редактировать КП
-🗑️ /delete_kp <id> - Удалить КП
-
-❓ /help_admin - Эта справка
-            """
-            await context.bot.send_message(chat_id=chat_id, text=help_text)
-        
-        elif message_text.startswith('/users'):
-            await self._handle_users_command(update, context)
-        
-        elif message_text.startswith('/new_users'):
-            await self._handle_new_users_command(update, context)
-        
-        elif message_text.startswith('/block'):
-            await self._handle_block_command(update, context)
-        
-        elif message_text.startswith('/unblock'):
-            await self._handle_unblock_command(update, context)
-        
-        elif message_text.startswith('/add_kp'):
-            await self._handle_add_kp_command(update, context, admin_direction)
-        
-        elif message_text.startswith('/list_kp'):
-            await self._handle_list_kp_command(update, context, admin_direction)
-        
-        elif message_text.startswith('/edit_kp'):
-            await self._handle_edit_kp_command(update, context, admin_direction)
-        
-        elif message_text.startswith('/delete_kp'):
-            await self._handle_delete_kp_command(update, context)
+        # Команда - первое слово без упоминания бота (/users@bot_name -> /users)
+        command = update.message.text.split(None, 1)[0].split('@', 1)[0].lower()
+        handler = self._admin_commands.get(command)
+        if handler is None:
+            return
         
-        elif message_text.startswith('/stats'):
-            await self._handle_stats_command(update, context)
-        elif message_text.startswith('/db_stats'):
-            await self._handle_db_stats_command(update, context)
-        elif message_text.startswith('/cleanup_db'):
-            await self._handle_cleanup_db_command(update, context)
+        logger.info("Processing admin command: %s in chat %s", command, chat_id)
+        await handler(update, context, admin_direction)
+    
+    async def _handle_help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
+        """Показывает справку по командам админа"""
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=_ADMIN_HELP_TEXT)
+    
+    async def _send_chunked(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, rows: List[str],
+                            limit: int = 3500) -> None:
+        """Отправляет строки несколькими сообщениями, не превышая лимит длины Telegram"""
+        chunk: List[str] = []
+        size = 0
+        for row in rows:
+            if chunk and size + len(row) > limit:
+                await context.bot.send_message(chat_id=chat_id, text="".join(chunk))
+                chunk, size = [], 0
+            chunk.append(row)
+            size += len(row)
+        
+        if chunk:
+            await context.bot.send_message(chat_id=chat_id, text="".join(chunk))
+    
+    @staticmethod
+    def _parse_page(message_text: str) -> int:
+        """Номер страницы из аргумента команды (/users 2), по умолчанию 1"""
+        parts = message_text.split()
+        return max(int(parts[1]), 1) if len(parts) > 1 and parts[1].isdigit() else 1
+    
+    async def _get_users_page(self, page: int, days: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Страница пользователей с учетом кэша; на одну запись больше, чтобы знать о следующей странице"""
+        key = (days, page)
+        users = self._admin_query_cache.get(key)
+        if users is None:
+            users = await self._db(
+                self.db.get_users_page, _USERS_PAGE_SIZE + 1, (page - 1) * _USERS_PAGE_SIZE, days
+            )
+            self._admin_query_cache.set(key, users)
+        return users
     
-    async def _handle_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показывает список всех пользователей"""
+    async def _handle_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
+        """Показывает список всех пользователей постранично (/users [страница])"""
         chat_id = update.effective_chat.id
-        users = self.db.get_all_users()
+        page = self._parse_page(update.message.text)
         
+        users = await self._get_users_page(page)
         if not users:
             await context.bot.send_message(chat_id=chat_id, text="❌ Пользователи не найдены.")
             return
         
-        message = "👥 ВСЕ ПОЛЬЗОВАТЕЛИ БОТА:\n\n"
+        rows = [f"👥 ВСЕ ПОЛЬЗОВАТЕЛИ БОТА (страница {page}):\n\n"]
         
-        for i, user in enumerate(users[:50], 1):  # Показываем только первых 50
-            status = "🚫 ЗАБЛОКИРОВАН" if user['is_blocked'] else "✅ АКТИВЕН"
-            username = f"@{user['username']}" if user['username'] else "Без username"
+        first = (page - 1) * _USERS_PAGE_SIZE + 1
+        for i, user in enumerate(users[:_USERS_PAGE_SIZE], first):
+            status = _USER_STATUS[bool(user['is_blocked'])]
+            username = f"@{uname}" if (uname := user['username']) else _NO_USERNAME
             name = f"{user['first_name']} {user['last_name']}".strip() if user['last_name'] else user['first_name']
             
-            message += f"{i}. {username}\n"
-            message += f"   Имя: {name}\n"
-            message += f"   ID: {user['user_id']}\n"
-            message += f"   Статус: {status}\n"
-            message += f"   Первый вход: {user['first_seen']}\n"
-            message += f"   Последняя активность: {user['last_activity']}\n\n"
+            rows.append(
+                f"{i}. {username}\n"
+                f"   Имя: {name}\n"
+                f"   ID: {user['user_id']}\n"
+                f"   Статус: {status}\n"
+                f"   Первый вход: {user['first_seen']}\n"
+                f"   Последняя активность: {user['last_activity']}\n\n"
+            )
         
-        if len(users) > 50:
-            message += f"... и еще {len(users) - 50} пользователей"
+        if len(users) > _USERS_PAGE_SIZE:
+            rows.append(f"Следующая страница: /users {page + 1}")
         
-        await context.bot.send_message(chat_id=chat_id, text=message)
+        await self._send_chunked(context, chat_id, rows)
     
-    async def _handle_new_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показывает новых пользователей за последние 7 дней"""
+    async def _handle_new_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
+        """Показывает новых пользователей за последние 7 дней постранично (/new_users [страница])"""
         chat_id = update.effective_chat.id
-        users = self.db.get_new_users(7)
+        page = self._parse_page(update.message.text)
         
+        users = await self._get_users_page(page, days=7)
         if not users:
             await context.bot.send_message(chat_id=chat_id, text="❌ Новых пользователей за последние 7 дней не найдено.")
             return
         
-        message = f"🆕 НОВЫЕ ПОЛЬЗОВАТЕЛИ (за 7 дней): {len(users)}\n\n"
+        rows = [f"🆕 НОВЫЕ ПОЛЬЗОВАТЕЛИ (за 7 дней, страница {page}):\n\n"]
         
-        for i, user in enumerate(users, 1):
-            status = "🚫 ЗАБЛОКИРОВАН" if user['is_blocked'] else "✅ АКТИВЕН"
-            username = f"@{user['username']}" if user['username'] else "Без username"
+        first = (page - 1) * _USERS_PAGE_SIZE + 1
+        for i, user in enumerate(users[:_USERS_PAGE_SIZE], first):
+            status = _USER_STATUS[bool(user['is_blocked'])]
+            username = f"@{uname}" if (uname := user['username']) else _NO_USERNAME
             name = f"{user['first_name']} {user['last_name']}".strip() if user['last_name'] else user['first_name']
             
-            message += f"{i}. {username}\n"
-            message += f"   Имя: {name}\n"
-            message += f"   ID: {user['user_id']}\n"
-            message += f"   Статус: {status}\n"
-            message += f"   Регистрация: {user['first_seen']}\n\n"
+            rows.append(
+                f"{i}. {username}\n"
+                f"   Имя: {name}\n"
+                f"   ID: {user['user_id']}\n"
+                f"   Статус: {status}\n"
+                f"   Регистрация: {user['first_seen']}\n\n"
+            )
         
-        await context.bot.send_message(chat_id=chat_id, text=message)
+        if len(users) > _USERS_PAGE_SIZE:
+            rows.append(f"Следующая страница: /new_users {page + 1}")
+        
+        await self._send_chunked(context, chat_id, rows)
     
-    async def _handle_block_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_block_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Блокирует пользователя"""
         chat_id = update.effective_chat.id
         message_text = update.message.text.strip()
@@ -991,12 +1267,18 @@ class ApplicationBot:
             await context.bot.send_message(chat_id=chat_id, text="❌ Неверный формат user_id. Используйте число.")
             return
         
-        if self.db.block_user(user_id):
+        # Пользователь мог написать недавно и еще не попасть в БД: дописываем его
+        # отложенную запись раньше блокировки (очередь записи выполняется по порядку)
+        self._flush_user(user_id)
+        
+        if await self.db_writer.submit(self.db.block_user, user_id):
+            self._set_blocked(user_id, True)
+            self._admin_query_cache.clear()
             await context.bot.send_message(chat_id=chat_id, text=f"🚫 Пользователь {user_id} заблокирован.")
         else:
             await context.bot.send_message(chat_id=chat_id, text=f"❌ Ошибка блокировки пользователя {user_id}.")
     
-    async def _handle_unblock_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_unblock_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Разблокирует пользователя"""
         chat_id = update.effective_chat.id
         message_text = update.message.text.strip()
@@ -1013,7 +1295,11 @@ class ApplicationBot:
             await context.bot.send_message(chat_id=chat_id, text="❌ Неверный формат user_id. Используйте число.")
             return
         
-        if self.db.unblock_user(user_id):
+        self._flush_user(user_id)
+        
+        if await self.db_writer.submit(self.db.unblock_user, user_id):
+            self._set_blocked(user_id, False)
+            self._admin_query_cache.clear()
             await context.bot.send_message(chat_id=chat_id, text=f"✅ Пользователь {user_id} разблокирован.")
         else:
             await context.bot.send_message(chat_id=chat_id, text=f"❌ Ошибка разблокировки пользователя {user_id}.")
@@ -1031,6 +1317,10 @@ class ApplicationBot:
         state = admin_state['state']
         kp_data = admin_state['kp_data']
         
+        # Состояния, сохраненные до появления current_offer, догружаем из БД
+        if state.startswith('edit_kp') and 'current_offer' not in admin_state:
+            admin_state['current_offer'] = await self._get_ready_offer(admin_state['kp_id'])
+        
         # Обработка добавления КП
         if state == 'add_kp_company_name':
             kp_data['company_name'] = text
@@ -1074,9 +1364,10 @@ class ApplicationBot:
                 kp_data['direction'] = admin_state['direction']
                 
                 # Сохраняем КП в БД
-                kp_id = self.db.add_ready_offer(kp_data)
+                kp_id = await self.db_writer.submit(self.db.add_ready_offer, kp_data)
                 
                 if kp_id:
+                    self._invalidate_offer()
                     await context.bot.send_message(
                         chat_id=chat_id,
                         text=f"✅ КП успешно добавлено! (ID: {kp_id})\n\n"
@@ -1102,7 +1393,7 @@ class ApplicationBot:
                 kp_data['company_name'] = text
             admin_state['state'] = 'edit_kp_inn'
             
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            current_offer = admin_state['current_offer']
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"2️⃣ Введите новый ИНН (текущий: {current_offer['inn']}) или '-':"
@@ -1113,7 +1404,7 @@ class ApplicationBot:
                 kp_data['inn'] = text
             admin_state['state'] = 'edit_kp_payment_purpose'
             
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            current_offer = admin_state['current_offer']
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"3️⃣ Введите новое назначение платежа (текущее: {current_offer['payment_purpose']}) или '-':"
@@ -1124,7 +1415,7 @@ class ApplicationBot:
                 kp_data['payment_purpose'] = text
             admin_state['state'] = 'edit_kp_bank'
             
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            current_offer = admin_state['current_offer']
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"4️⃣ Введите новое название банка (текущий: {current_offer['bank']}) или '-':"
@@ -1135,7 +1426,7 @@ class ApplicationBot:
                 kp_data['bank'] = text
             admin_state['state'] = 'edit_kp_min_amount'
             
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            current_offer = admin_state['current_offer']
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"5️⃣ Введите новую минимальную сумму (текущая: {current_offer['min_amount']:,}) или '-':"
@@ -1150,7 +1441,7 @@ class ApplicationBot:
                     return
             
             admin_state['state'] = 'edit_kp_max_amount'
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            current_offer = admin_state['current_offer']
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"6️⃣ Введите новую максимальную сумму (текущая: {current_offer['max_amount']:,}) или '-':"
@@ -1175,8 +1466,8 @@ class ApplicationBot:
                     await context.bot.send_message(chat_id=chat_id, text="❌ Неверный формат. Введите число (например: 2.5) или '-':")
                     return
             
-            # Получаем текущие данные КП
-            current_offer = self.db.get_ready_offer_by_id(admin_state['kp_id'])
+            # Текущие данные КП (сохранены при /edit_kp)
+            current_offer = admin_state['current_offer']
             
             # Заполняем недостающие поля из текущих данных
             final_data = {
@@ -1191,7 +1482,8 @@ class ApplicationBot:
             }
             
             # Обновляем КП в БД
-            if self.db.update_ready_offer(admin_state['kp_id'], final_data):
+            if await self.db_writer.submit(self.db.update_ready_offer, admin_state['kp_id'], final_data):
+                self._invalidate_offer(admin_state['kp_id'])
                 await context.bot.send_message(
                     chat_id=chat_id,
                     text=f"✅ КП успешно обновлено! (ID: {admin_state['kp_id']})\n\n"
@@ -1207,6 +1499,10 @@ class ApplicationBot:
             
             # Очищаем состояние
             del self.admin_states[user_id]
+        
+        # Сохраняем изменения состояния, если процесс еще не завершен
+        if user_id in self.admin_states:
+            self.admin_states[user_id] = admin_state
     
     async def _handle_add_kp_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Начинает процесс добавления КП"""
@@ -1230,7 +1526,7 @@ class ApplicationBot:
         """Показывает список всех КП для данного направления"""
         chat_id = update.effective_chat.id
         
-        offers = self.db.get_ready_offers_by_direction(admin_direction, limit=100)
+        offers = await self._db(self.db.get_ready_offers_by_direction, admin_direction, 100)
         
         if not offers:
             await context.bot.send_message(
@@ -1239,25 +1535,13 @@ class ApplicationBot:
             )
             return
         
-        message = f"📋 СПИСОК КП ({DIRECTIONS.get(admin_direction, 'Неизвестно')}):\n\n"
+        rows = [f"📋 СПИСОК КП ({DIRECTIONS.get(admin_direction, 'Неизвестно')}):\n\n"]
         
         for i, offer in enumerate(offers, 1):
             commission_text = f"{offer.get('commission', 0)}%" if offer.get('commission', 0) > 0 else "0%"
-            message += f"{i}. ID: {offer['id']}\n"
-            message += f"   🏢 {offer['company_name']}\n"
-            message += f"   🔢 ИНН: {offer['inn']}\n"
-            message += f"   🏦 Банк: {offer['bank']}\n"
-            message += f"   📝 Назначение: {offer['payment_purpose']}\n"
-            message += f"   💰 Сумма: {offer['min_amount']:,} - {offer['max_amount']:,} руб.\n"
-            message += f"   📊 Комиссия: {commission_text}\n\n"
-            
-            # Telegram имеет лимит на длину сообщения
-            if len(message) > 3500:
-                await context.bot.send_message(chat_id=chat_id, text=message)
-                message = ""
-        
-        if message:
-            await context.bot.send_message(chat_id=chat_id, text=message)
+            rows.append(_KP_ROW_TEMPLATE.format_map({**offer, 'i': i, 'commission_text': commission_text}))
+        
+        await self._send_chunked(context, chat_id, rows)
     
     async def _handle_edit_kp_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Редактирует КП"""
@@ -1283,7 +1567,7 @@ class ApplicationBot:
             return
         
         # Получаем КП из БД
-        offer = self.db.get_ready_offer_by_id(kp_id)
+        offer = await self._get_ready_offer(kp_id)
         
         if not offer:
             await context.bot.send_message(
@@ -1306,7 +1590,9 @@ class ApplicationBot:
             'direction': admin_direction,
             'chat_id': chat_id,
             'kp_id': kp_id,
-            'kp_data': {}
+            'kp_data': {},
+            # Текущие данные КП для подсказок на каждом шаге (без повторных запросов к БД)
+            'current_offer': offer
         }
         
         commission_text = f"{offer.get('commission', 0)}%" if offer.get('commission', 0) > 0 else "0%"
@@ -1327,7 +1613,7 @@ class ApplicationBot:
 1️⃣ Введите новое название фирмы (или отправьте '-' чтобы оставить текущее):"""
         )
     
-    async def _handle_delete_kp_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_delete_kp_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Удаляет КП"""
         chat_id = update.effective_chat.id
         message_text = update.message.text.strip()
@@ -1349,8 +1635,8 @@ class ApplicationBot:
             )
             return
         
-        # Получаем КП перед удалением
-        offer = self.db.get_ready_offer_by_id(kp_id)
+        # Удаляем КП; DELETE ... RETURNING сразу отдает удаленную строку
+        offer = await self.db_writer.submit(self.db.pop_ready_offer, kp_id)
         
         if not offer:
             await context.bot.send_message(
@@ -1359,50 +1645,43 @@ class ApplicationBot:
             )
             return
         
-        # Показываем информацию о КП с комиссией
-        commission_text = f"{offer.get('commission', 0)}%" if offer.get('commission', 0) > 0 else "0%"
+        self._invalidate_offer(kp_id)
         
-        # Удаляем КП
-        if self.db.delete_ready_offer(kp_id):
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"✅ КП успешно удалено!\n\n"
-                     f"🏢 Фирма: {offer['company_name']}\n"
-                     f"🔢 ИНН: {offer['inn']}\n"
-                     f"🏦 Банк: {offer['bank']}\n"
-                     f"📝 Назначение: {offer['payment_purpose']}\n"
-                     f"💰 Сумма: {offer['min_amount']:,} - {offer['max_amount']:,} руб.\n"
-                     f"📊 Комиссия: {commission_text}\n"
-                     f"🆔 ID: {kp_id}"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"❌ Ошибка удаления КП {kp_id}."
-            )
+        # Показываем информацию об удаленном КП с комиссией
+        commission = offer.get('commission') or 0
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=_KP_DELETED_TEMPLATE.format_map({
+                **offer,
+                'commission_text': f"{commission}%" if commission > 0 else "0%"
+            })
+        )
     
-    async def _handle_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _handle_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str):
         """Показывает статистику за день"""
         chat_id = update.effective_chat.id
         
-        logger.info(f"Stats command called from chat {chat_id} (type: {type(chat_id)})")
-        logger.info(f"OWNER_CHAT_ID: {OWNER_CHAT_ID} (type: {type(OWNER_CHAT_ID)})")
-        logger.info(f"String comparison: '{chat_id}' != '{OWNER_CHAT_ID}' = {str(chat_id) != str(OWNER_CHAT_ID)}")
+        logger.debug("Stats command called from chat %s (type: %s)", chat_id, type(chat_id))
+        logger.debug("OWNER_CHAT_ID: %s (type: %s)", OWNER_CHAT_ID, type(OWNER_CHAT_ID))
+        logger.debug("String comparison: '%s' != '%s' = %s", chat_id, OWNER_CHAT_ID, str(chat_id) != str(OWNER_CHAT_ID))
         
         # Проверяем, что это чат владельца
         if str(chat_id) != str(OWNER_CHAT_ID):
-            logger.info(f"Access denied: chat_id={chat_id}, OWNER_CHAT_ID={OWNER_CHAT_ID}")
-            await update.message.reply_text(f"❌ Доступ запрещен. Эта команда доступна только владельцу.\nВаш chat_id: {chat_id}\nОжидаемый: {OWNER_CHAT_ID}")
+            logger.info("Access denied: chat_id=%s, OWNER_CHAT_ID=%s", chat_id, OWNER_CHAT_ID)
+            await update.message.reply_text(_OWNER_ONLY_DETAILS_TEMPLATE.format(chat_id))
             return
         
+        stats = None
         try:
-            stats = self.db.get_daily_statistics()
-            
-            if not stats:
-                await update.message.reply_text("❌ Ошибка получения статистики")
-                return
-            
-            stats_text = f"""
+            stats = await self._db(self.db.get_daily_statistics)
+        except Exception as e:
+            logger.error("Error getting statistics: %s", e)
+        
+        if not stats:
+            await update.message.reply_text("❌ Ошибка получения статистики")
+            return
+        
+        parts = [f"""
 📊 СТАТИСТИКА ЗА ДЕНЬ ({stats['date']})
 
 📋 Заявок: {stats['applications_count']}
@@ -1411,33 +1690,29 @@ class ApplicationBot:
 ✅ Принято: {stats['feedback_stats'].get('yes', 0)}
 ❌ Отклонено: {stats['feedback_stats'].get('no', 0)}
 
-🏗️ По направлениям:"""
-            
-            for direction, count in stats['direction_stats'].items():
-                direction_name = DIRECTIONS.get(direction, direction)
-                stats_text += f"\n• {direction_name}: {count}"
-            
-            await update.message.reply_text(stats_text)
-            
-        except Exception as e:
-            logger.error(f"Error getting statistics: {e}")
-            await update.message.reply_text("❌ Ошибка получения статистики")
+🏗️ По направлениям:"""]
+        parts.extend(
+            f"\n• {DIRECTIONS.get(direction, direction)}: {count}"
+            for direction, count in stats['direction_stats'].items()
+        )
+        
+        await update.message.reply_text("".join(parts))
     
-    async def _handle_db_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def _handle_db_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str) -> None:
         """Показывает статистику базы данных"""
         chat_id = update.effective_chat.id
         
-        logger.info(f"DB stats command called from chat {chat_id} (type: {type(chat_id)})")
-        logger.info(f"OWNER_CHAT_ID: {OWNER_CHAT_ID} (type: {type(OWNER_CHAT_ID)})")
-        logger.info(f"String comparison: '{chat_id}' != '{OWNER_CHAT_ID}' = {str(chat_id) != str(OWNER_CHAT_ID)}")
+        logger.debug("DB stats command called from chat %s (type: %s)", chat_id, type(chat_id))
+        logger.debug("OWNER_CHAT_ID: %s (type: %s)", OWNER_CHAT_ID, type(OWNER_CHAT_ID))
+        logger.debug("String comparison: '%s' != '%s' = %s", chat_id, OWNER_CHAT_ID, str(chat_id) != str(OWNER_CHAT_ID))
         
         if str(chat_id) != str(OWNER_CHAT_ID):
-            logger.info(f"Access denied: chat_id={chat_id}, OWNER_CHAT_ID={OWNER_CHAT_ID}")
-            await update.message.reply_text(f"❌ Доступ запрещен. Эта команда доступна только владельцу.\nВаш chat_id: {chat_id}\nОжидаемый: {OWNER_CHAT_ID}")
+            logger.info("Access denied: chat_id=%s, OWNER_CHAT_ID=%s", chat_id, OWNER_CHAT_ID)
+            await update.message.reply_text(_OWNER_ONLY_DETAILS_TEMPLATE.format(chat_id))
             return
         
         try:
-            stats = self.db.get_database_stats()
+            stats = await self._db(self.db.get_database_stats)
             if not stats:
                 await update.message.reply_text("❌ Ошибка получения статистики БД")
                 return
@@ -1457,26 +1732,26 @@ class ApplicationBot:
             await update.message.reply_text(stats_text)
             
         except Exception as e:
-            logger.error(f"Error getting database statistics: {e}")
+            logger.error("Error getting database statistics: %s", e)
             await update.message.reply_text("❌ Ошибка получения статистики БД")
     
-    async def _handle_cleanup_db_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async def _handle_cleanup_db_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, admin_direction: str) -> None:
         """Очищает старые данные из БД"""
         chat_id = update.effective_chat.id
         
         if str(chat_id) != str(OWNER_CHAT_ID):
-            await update.message.reply_text(f"❌ Доступ запрещен. Эта команда доступна только владельцу.")
+            await update.message.reply_text(_OWNER_ONLY_TEXT)
             return
         
         try:
             # Получаем статистику до очистки
-            stats_before = self.db.get_database_stats()
+            stats_before = await self._db(self.db.get_database_stats)
             
-            # Выполняем очистку
-            cleanup_result = self.db.cleanup_old_data()
+            # Выполняем очистку (пачками, в отдельном потоке - может идти долго)
+            cleanup_result = await self._db(self.db.cleanup_old_data)
             
             # Получаем статистику после очистки
-            stats_after = self.db.get_database_stats()
+            stats_after = await self._db(self.db.get_database_stats)
             
             cleanup_text = f"""🧹 ОЧИСТКА БД ЗАВЕРШЕНА
 
@@ -1499,12 +1774,12 @@ class ApplicationBot:
             await update.message.reply_text(cleanup_text)
             
         except Exception as e:
-            logger.error(f"Error cleaning database: {e}")
+            logger.error("Error cleaning database: %s", e)
             await update.message.reply_text("❌ Ошибка очистки БД")
     
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик ошибок"""
-        logger.error(f"Error processing update: {context.error}")
+        logger.error("Error processing update", exc_info=context.error)
         if update and update.effective_message:
             await update.effective_message.reply_text(
                 "❌ Произошла ошибка. Попробуйте позже."
@@ -1544,17 +1819,28 @@ def main() -> None:
     else:
         print("Ошибка оптимизации БД")
     
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Создаем приложение. Исходящие запросы ограничиваются лимитами Telegram
+    # (30 сообщений/сек всего, 20/мин в группу); при 429 запрос повторяется после retry_after.
+    # Пул соединений (по умолчанию одно) позволяет отправлять сообщения параллельно
+    # по уже открытым keep-alive соединениям
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(32)
+        .pool_timeout(10)
+        .rate_limiter(AIORateLimiter(max_retries=1))
+        .build()
+    )
     
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", bot.start))
     application.add_handler(CallbackQueryHandler(bot.button_callback))
     
-    # Обработчик команд (все чаты)
-    application.add_handler(MessageHandler(
-        filters.TEXT & filters.COMMAND, 
-        bot.handle_text_message
+    # Команды админа: только из админских чатов, сразу в handle_admin_command
+    application.add_handler(CommandHandler(
+        [command.lstrip('/') for command in bot._admin_commands],
+        bot.handle_admin_command,
+        filters=filters.Chat(chat_id=_ADMIN_CHAT_IDS)
     ))
     
     # Обработчик текстовых сообщений (не команды, все чаты)
@@ -1568,13 +1854,31 @@ def main() -> None:
     
     # Запускаем ежедневную очистку после инициализации приложения
     async def post_init(application):
-        bot.start_daily_cleanup()
+        bot.db_writer.start()
+        bot.start_daily_cleanup(application.bot)
+        bot.start_users_flush()
+    
+    async def post_shutdown(application):
+        await bot.shutdown()
     
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
     
-    # Запускаем бота
-    print("Бот запущен и готов к работе!")
-    application.run_polling()
+    # Запускаем бота: webhook, если задан публичный URL, иначе long polling
+    if WEBHOOK_URL:
+        webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+        print(f"Бот запущен в режиме webhook: {webhook_url}")
+        # Telegram получает 200 сразу, обновления обрабатываются через update_queue
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        print("Бот запущен и готов к работе!")
+        application.run_polling()
 
 
 if __name__ == '__main__':
@@ -12,6 +12,13 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 # Чат владельца для уведомлений и статистики
 OWNER_CHAT_ID = os.getenv('OWNER_CHAT_ID')
 
+# Настройки webhook (если WEBHOOK_URL не задан, бот работает через long polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
 # Админские чаты для каждого направления
 ADMIN_CHATS = {
     'stroymat': os.getenv('STROYMAT_CHAT_ID'),
@@ -25,6 +32,9 @@ ADMIN_CHATS = {
     'other': os.getenv('OTHER_CHAT_ID')
 }
 
+# ID чатов приводим к int один раз при загрузке (ненастроенные остаются None)
+ADMIN_CHATS = {direction: int(chat_id) if chat_id else None for direction, chat_id in ADMIN_CHATS.items()}
+
 # Направления деятельности (ключи используются в БД и коде)
 DIRECTIONS = {
     'stroymat': 'Строймат',
@@ -5,25 +5,144 @@
 Модуль для работы с базой данных КП
 """
 
+import functools
 import sqlite3
 import json
 import logging
-from typing import Dict, List, Optional, Any, Union
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Any, Set, Union, Iterable, Iterator
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Настройки каждого соединения (journal_mode=WAL хранится в самом файле БД и ставится в init_database)
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",          # временные таблицы сортировок/группировок в памяти
+    "PRAGMA mmap_size=268435456",        # чтение страниц через mmap (256 MiB), без копирования в буфер
+    "PRAGMA cache_size=-65536",          # кэш страниц до 64 MiB, память выделяется по мере надобности
+    "PRAGMA foreign_keys=ON",            # проверка payment_purposes.direction_key -> directions.key
+)
+
+# Версия схемы в PRAGMA user_version: миграции ready_offers выполнены
+_SCHEMA_VERSION = 1
+
+
+def _db_op(error_message: str, default: Any = False) -> Callable:
+    """Декоратор метода KPDatabase: открывает транзакцию на соединении потока
+    и передает курсор вторым аргументом.
+
+    Ловятся только ошибки SQLite - они логируются, и метод возвращает default
+    (list/dict передаются как фабрика, чтобы не отдавать общий изменяемый объект).
+    Остальные исключения (ошибки в коде) пробрасываются.
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                with self._connection() as conn:
+                    return method(self, conn.cursor(), *args, **kwargs)
+            except sqlite3.Error as e:
+                logger.error(f"{error_message}: {e}")
+                return default() if callable(default) else default
+        return wrapper
+    return decorator
+
 class KPDatabase:
     """Класс для работы с базой данных КП"""
     
     def __init__(self, db_path: str = 'kp_database.db') -> None:
         self.db_path = db_path
+        # Постоянное соединение своё для каждого потока (и флаг открытой транзакции)
+        self._local = threading.local()
+        # Все открытые соединения, чтобы закрыть их при остановке
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Направления меняются только через add_direction
+        self._directions_cache: Optional[Dict[str, str]] = None
         self.init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение с БД"""
+        # Соединением пользуется только создавший его поток;
+        # check_same_thread=False нужен лишь для закрытия в close().
+        # cached_statements с запасом вмещает все запросы модуля - каждый готовится один раз
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, cached_statements=256)
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _get_conn(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, открывая его при первом обращении.
+        
+        Соединение живет вместе с потоком: файл БД, схема и кэш страниц
+        не переоткрываются на каждый запрос.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдает соединение потока.
+        
+        Вне транзакции изменения коммитятся при успешном выходе из блока
+        (или откатываются при ошибке); внутри transaction() - в её конце.
+        """
+        conn = self._get_conn()
+        if getattr(self._local, 'in_transaction', False):
+            yield conn
+            return
+        
+        with conn:
+            yield conn
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Выполняет все вызовы методов внутри блока одной транзакцией"""
+        conn = self._get_conn()
+        if getattr(self._local, 'in_transaction', False):
+            yield conn
+            return
+        
+        self._local.in_transaction = True
+        try:
+            with conn:
+                # Берем блокировку записи сразу: иначе отложенная транзакция может
+                # получить SQLITE_BUSY при повышении блокировки посреди пачки
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            self._local.in_transaction = False
+    
+    def close(self) -> None:
+        """Закрывает соединения всех потоков (при остановке бота)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        
+        for conn in connections:
+            try:
+                # Статистика по запросам этого соединения - рекомендуемый SQLite шаг перед закрытием
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing connection: {e}")
+    
     def init_database(self) -> None:
         """Инициализирует базу данных"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # WAL режим сохраняется в файле БД: читатели не блокируют писателя.
+            # journal_mode нельзя менять внутри транзакции, поэтому он до неё
+            self._get_conn().execute("PRAGMA journal_mode=WAL")
+            
+            # Таблицы, миграции и индексы - одной транзакцией (один fsync при первом запуске)
+            with self.transaction() as conn:
                 cursor = conn.cursor()
                 
                 # Таблица направлений
@@ -86,35 +205,40 @@ class KPDatabase:
                     )
                 ''')
                 
-                # Миграция: проверяем и добавляем недостающие колонки
-                cursor.execute("PRAGMA table_info(ready_offers)")
-                columns = [column[1] for column in cursor.fetchall()]
-                
-                if 'company_name' not in columns:
-                    # Старая структура, нужно пересоздать таблицу
-                    cursor.execute('DROP TABLE IF EXISTS ready_offers')
-                    cursor.execute('''
-                        CREATE TABLE ready_offers (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            company_name TEXT NOT NULL,
-                            inn TEXT NOT NULL,
-                            direction TEXT NOT NULL,
-                            payment_purpose TEXT NOT NULL,
-                            bank TEXT NOT NULL,
-                            min_amount INTEGER DEFAULT 0,
-                            max_amount INTEGER DEFAULT 0,
-                            commission REAL DEFAULT 0.0,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                    logger.info("Table ready_offers recreated with new structure")
-                else:
-                    # Проверяем наличие колонки commission
-                    if 'commission' not in columns:
-                        cursor.execute('ALTER TABLE ready_offers ADD COLUMN commission REAL DEFAULT 0.0')
-                        logger.info("Added commission column to ready_offers")
-                    logger.info("Table ready_offers already has correct structure")
+                # Миграция: проверяем и добавляем недостающие колонки.
+                # Версия схемы хранится в user_version, чтобы не проверять таблицу при каждом запуске
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] < _SCHEMA_VERSION:
+                    cursor.execute("PRAGMA table_info(ready_offers)")
+                    columns = [column[1] for column in cursor.fetchall()]
+                    
+                    if 'company_name' not in columns:
+                        # Старая структура, нужно пересоздать таблицу
+                        cursor.execute('DROP TABLE IF EXISTS ready_offers')
+                        cursor.execute('''
+                            CREATE TABLE ready_offers (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                company_name TEXT NOT NULL,
+                                inn TEXT NOT NULL,
+                                direction TEXT NOT NULL,
+                                payment_purpose TEXT NOT NULL,
+                                bank TEXT NOT NULL,
+                                min_amount INTEGER DEFAULT 0,
+                                max_amount INTEGER DEFAULT 0,
+                                commission REAL DEFAULT 0.0,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        logger.info("Table ready_offers recreated with new structure")
+                    else:
+                        # Проверяем наличие колонки commission
+                        if 'commission' not in columns:
+                            cursor.execute('ALTER TABLE ready_offers ADD COLUMN commission REAL DEFAULT 0.0')
+                            logger.info("Added commission column to ready_offers")
+                        logger.info("Table ready_offers already has correct structure")
+                    
+                    cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
                 
                 # Таблица обратной связи
                 cursor.execute('''
@@ -163,13 +287,20 @@ class KPDatabase:
                     )
                 ''')
                 
+                # Таблица сессий (состояния пользователей и админов с TTL)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS kv_sessions (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                ''')
+                
                 # Добавляем индексы для оптимизации
                 self._create_indexes(cursor)
-                
-                conn.commit()
                 logger.info("Database initialized successfully")
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             logger.error(f"Database initialization error: {e}")
     
     def _create_indexes(self, cursor) -> None:
@@ -184,7 +315,8 @@ class KPDatabase:
             # Индексы для feedback
             "CREATE INDEX IF NOT EXISTS idx_feedback_user_id ON feedback(user_id)",
             "CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at)",
-            "CREATE INDEX IF NOT EXISTS idx_feedback_type ON feedback(feedback_type)",
+            # (тип, дата): очистка отрицательных отзывов и подсчеты по типу
+            "CREATE INDEX IF NOT EXISTS idx_feedback_type_created_at ON feedback(feedback_type, created_at)",
             "CREATE INDEX IF NOT EXISTS idx_feedback_direction ON feedback(direction)",
             
             # Индексы для owner_notifications
@@ -193,686 +325,681 @@ class KPDatabase:
             "CREATE INDEX IF NOT EXISTS idx_notifications_direction ON owner_notifications(direction)",
             
             # Индексы для ready_offers
-            "CREATE INDEX IF NOT EXISTS idx_offers_direction ON ready_offers(direction)",
+            # (направление, дата): страница КП отдается по индексу без сортировки
+            "CREATE INDEX IF NOT EXISTS idx_offers_direction_created_at ON ready_offers(direction, created_at)",
             "CREATE INDEX IF NOT EXISTS idx_offers_created_at ON ready_offers(created_at)",
             
+            # Индексы для payment_purposes (поиск по направлению и проверка внешнего ключа)
+            "CREATE INDEX IF NOT EXISTS idx_payment_purposes_direction_key ON payment_purposes(direction_key)",
+            
             # Индексы для users
             "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(first_seen)",
             "CREATE INDEX IF NOT EXISTS idx_users_blocked ON users(is_blocked)",
+            
+            # Индексы для kv_sessions
+            "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON kv_sessions(expires_at)",
         ]
         
         for index_sql in indexes:
             try:
                 cursor.execute(index_sql)
-                logger.info(f"Created index: {index_sql.split('idx_')[1].split(' ')[0]}")
-            except Exception as e:
+            except sqlite3.Error as e:
                 logger.error(f"Error creating index: {e}")
+        logger.info(f"Indexes checked: {len(indexes)}")
+
+        # Одиночные индексы, которые покрываются составными выше
+        for index_name in ('idx_feedback_type', 'idx_offers_direction'):
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
     
-    def add_direction(self, key: str, name: str) -> bool:
+    @_db_op("Error adding direction")
+    def add_direction(self, cursor, key: str, name: str) -> bool:
         """Добавляет новое направление"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'INSERT OR REPLACE INTO directions (key, name) VALUES (?, ?)',
-                    (key, name)
-                )
-                conn.commit()
-                logger.info(f"Direction {key}: {name} added/updated")
-                return True
-        except Exception as e:
-            logger.error(f"Error adding direction: {e}")
+        cursor.execute(
+            'INSERT OR REPLACE INTO directions (key, name) VALUES (?, ?)',
+            (key, name)
+        )
+        self._directions_cache = None
+        logger.info(f"Direction {key}: {name} added/updated")
+        return True
+    
+    @staticmethod
+    def _direction_exists(cursor, direction_key: str) -> bool:
+        """Проверяет направление перед добавлением назначений: с foreign_keys=ON
+        вставка для неизвестного направления падает с IntegrityError"""
+        cursor.execute('SELECT 1 FROM directions WHERE key = ?', (direction_key,))
+        if cursor.fetchone() is None:
+            logger.warning(f"Unknown direction {direction_key}, purposes not added")
             return False
+        return True
     
-    def add_payment_purpose(self, direction_key: str, purpose: str) -> bool:
+    @_db_op("Error adding purpose")
+    def add_payment_purpose(self, cursor, direction_key: str, purpose: str) -> bool:
         """Добавляет назначение платежа для направления"""
+        if not self._direction_exists(cursor, direction_key):
+            return False
+        
+        cursor.execute(
+            'INSERT OR IGNORE INTO payment_purposes (direction_key, purpose) VALUES (?, ?)',
+            (direction_key, purpose)
+        )
+        logger.info(f"Purpose {purpose} added for direction {direction_key}")
+        return True
+    
+    def add_payment_purposes(self, direction_key: str, purposes: Iterable[str]) -> bool:
+        """Добавляет несколько назначений платежа для направления одной транзакцией"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
-                cursor.execute(
+                if not self._direction_exists(cursor, direction_key):
+                    return False
+                
+                cursor.executemany(
                     'INSERT OR IGNORE INTO payment_purposes (direction_key, purpose) VALUES (?, ?)',
-                    (direction_key, purpose)
+                    ((direction_key, purpose) for purpose in purposes)
                 )
-                conn.commit()
-                logger.info(f"Purpose {purpose} added for direction {direction_key}")
-                return True
-        except Exception as e:
-            logger.error(f"Error adding purpose: {e}")
+                logger.info(f"{cursor.rowcount} purposes added for direction {direction_key}")
+            return True
+            
+        except sqlite3.Error as e:
+            logger.error(f"Error adding purposes: {e}")
             return False
     
-    def add_ready_offer(self, offer_data: Dict[str, Any]) -> int:
+    _INSERT_OFFER_SQL = '''
+        INSERT INTO ready_offers 
+        (company_name, inn, direction, payment_purpose, bank, min_amount, max_amount, commission)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    @staticmethod
+    def _offer_row(offer_data: Dict[str, Any]) -> tuple:
+        return (
+            offer_data['company_name'],
+            offer_data['inn'],
+            offer_data['direction'],
+            offer_data['payment_purpose'],
+            offer_data['bank'],
+            offer_data.get('min_amount', 0),
+            offer_data.get('max_amount', 0),
+            offer_data.get('commission', 0.0)
+        )
+    
+    @_db_op("Error adding offer", 0)
+    def add_ready_offer(self, cursor, offer_data: Dict[str, Any]) -> int:
         """Добавляет готовое КП"""
+        cursor.execute(self._INSERT_OFFER_SQL, self._offer_row(offer_data))
+        # ID созданного КП
+        new_id = cursor.lastrowid
+        logger.info(f"Offer {offer_data['company_name']} added with ID: {new_id}")
+        return new_id
+    
+    def add_ready_offers_many(self, offers: List[Dict[str, Any]]) -> int:
+        """Добавляет несколько готовых КП одной транзакцией, возвращает их количество"""
+        if not offers:
+            return 0
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO ready_offers 
-                    (company_name, inn, direction, payment_purpose, bank, min_amount, max_amount, commission)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    offer_data['company_name'],
-                    offer_data['inn'],
-                    offer_data['direction'],
-                    offer_data['payment_purpose'],
-                    offer_data['bank'],
-                    offer_data.get('min_amount', 0),
-                    offer_data.get('max_amount', 0),
-                    offer_data.get('commission', 0.0)
-                ))
-                
-                conn.commit()
-                # Получаем ID созданного КП
-                cursor.execute('SELECT last_insert_rowid()')
-                new_id = cursor.fetchone()[0]
-                logger.info(f"Offer {offer_data['company_name']} added with ID: {new_id}")
-                return new_id
-                
-        except Exception as e:
-            logger.error(f"Error adding offer: {e}")
+            # transaction(): вся пачка либо записывается, либо откатывается целиком
+            with self.transaction() as conn:
+                conn.executemany(self._INSERT_OFFER_SQL, (self._offer_row(offer) for offer in offers))
+            logger.info(f"Added {len(offers)} offers")
+            return len(offers)
+            
+        except sqlite3.Error as e:
+            logger.error(f"Error adding offers: {e}")
             return 0
     
-    def get_ready_offers_by_direction(self, direction: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    @_db_op("Error getting offer", list)
+    def get_ready_offers_by_direction(self, cursor, direction: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
         """Получает готовые КП по направлению с пагинацией"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, company_name, inn, direction, payment_purpose, 
-                           bank, min_amount, max_amount, commission, created_at
-                    FROM ready_offers 
-                    WHERE direction = ?
-                    ORDER BY created_at DESC
-                    LIMIT ? OFFSET ?
-                ''', (direction, limit, offset))
-                
-                offers = []
-                for row in cursor.fetchall():
-                    offers.append({
-                        'id': row[0],
-                        'company_name': row[1],
-                        'inn': row[2],
-                        'direction': row[3],
-                        'payment_purpose': row[4],
-                        'bank': row[5],
-                        'min_amount': row[6],
-                        'max_amount': row[7],
-                        'commission': row[8],
-                        'created_at': row[9]
-                    })
-                
-                return offers
-                
-        except Exception as e:
-            logger.error(f"Error getting offer: {e}")
-            return []
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('''
+            SELECT id, company_name, inn, direction, payment_purpose, 
+                   bank, min_amount, max_amount, commission, created_at
+            FROM ready_offers 
+            WHERE direction = ?
+            ORDER BY created_at DESC
+            LIMIT ? OFFSET ?
+        ''', (direction, limit, offset))
+        
+        return [dict(row) for row in cursor.fetchall()]
     
-    def get_ready_offer_by_id(self, offer_id: int) -> Optional[Dict[str, Any]]:
+    @_db_op("Error getting offer", None)
+    def get_ready_offer_by_id(self, cursor, offer_id: int) -> Optional[Dict[str, Any]]:
         """Получает КП по ID"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, company_name, inn, direction, payment_purpose, 
-                           bank, min_amount, max_amount, commission, created_at
-                    FROM ready_offers 
-                    WHERE id = ?
-                ''', (offer_id,))
-                
-                row = cursor.fetchone()
-                if row:
-                    return {
-                        'id': row[0],
-                        'company_name': row[1],
-                        'inn': row[2],
-                        'direction': row[3],
-                        'payment_purpose': row[4],
-                        'bank': row[5],
-                        'min_amount': row[6],
-                        'max_amount': row[7],
-                        'commission': row[8],
-                        'created_at': row[9]
-                    }
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error getting offer: {e}")
-            return None
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('''
+            SELECT id, company_name, inn, direction, payment_purpose, 
+                   bank, min_amount, max_amount, commission, created_at
+            FROM ready_offers 
+            WHERE id = ?
+        ''', (offer_id,))
+        
+        row = cursor.fetchone()
+        return dict(row) if row else None
     
-    def update_ready_offer(self, offer_id: int, offer_data: Dict[str, Any]) -> bool:
+    @_db_op("Error updating offer")
+    def update_ready_offer(self, cursor, offer_id: int, offer_data: Dict[str, Any]) -> bool:
         """Обновляет готовое КП"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE ready_offers 
-                    SET company_name = ?, inn = ?, direction = ?, payment_purpose = ?, 
-                        bank = ?, min_amount = ?, max_amount = ?, commission = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (
-                    offer_data['company_name'],
-                    offer_data['inn'],
-                    offer_data['direction'],
-                    offer_data['payment_purpose'],
-                    offer_data['bank'],
-                    offer_data.get('min_amount', 0),
-                    offer_data.get('max_amount', 0),
-                    offer_data.get('commission', 0.0),
-                    offer_id
-                ))
-                
-                conn.commit()
-                return cursor.rowcount > 0
-                
-        except Exception as e:
-            logger.error(f"Error updating offer: {e}")
-            return False
+        cursor.execute('''
+            UPDATE ready_offers 
+            SET company_name = ?, inn = ?, direction = ?, payment_purpose = ?, 
+                bank = ?, min_amount = ?, max_amount = ?, commission = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (
+            offer_data['company_name'],
+            offer_data['inn'],
+            offer_data['direction'],
+            offer_data['payment_purpose'],
+            offer_data['bank'],
+            offer_data.get('min_amount', 0),
+            offer_data.get('max_amount', 0),
+            offer_data.get('commission', 0.0),
+            offer_id
+        ))
+        return cursor.rowcount > 0
+    
+    @_db_op("Error deleting offer", None)
+    def pop_ready_offer(self, cursor, offer_id: int) -> Optional[Dict[str, Any]]:
+        """Удаляет готовое КП и возвращает его данные одним запросом (None если КП нет)"""
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('''
+            DELETE FROM ready_offers WHERE id = ?
+            RETURNING id, company_name, inn, direction, payment_purpose,
+                      bank, min_amount, max_amount, commission, created_at
+        ''', (offer_id,))
+        
+        row = cursor.fetchone()
+        return dict(row) if row else None
     
-    def delete_ready_offer(self, offer_id: int) -> bool:
+    @_db_op("Error deleting offer")
+    def delete_ready_offer(self, cursor, offer_id: int) -> bool:
         """Удаляет готовое КП"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('DELETE FROM ready_offers WHERE id = ?', (offer_id,))
-                conn.commit()
-                return cursor.rowcount > 0
-                
-        except Exception as e:
-            logger.error(f"Error deleting offer: {e}")
-            return False
+        cursor.execute('DELETE FROM ready_offers WHERE id = ?', (offer_id,))
+        return cursor.rowcount > 0
+    
+    _INSERT_APPLICATION_SQL = '''
+        INSERT INTO client_applications 
+        (user_id, direction, company_name, inn, bank, nds_rate, 
+         category, payment_purpose, amount, equipment_type, 
+         description, operation_type, admin_message_id, admin_chat_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
     
-    def add_client_application(self, application_data: Dict[str, Any]) -> int:
+    @staticmethod
+    def _application_row(application_data: Dict[str, Any]) -> tuple:
+        return (
+            application_data['user_id'],
+            application_data['direction'],
+            application_data['company_name'],
+            application_data['inn'],
+            application_data['bank'],
+            application_data['nds_rate'],
+            application_data['category'],
+            application_data['payment_purpose'],
+            application_data['amount'],
+            application_data['equipment_type'],
+            application_data.get('description', ''),
+            application_data['operation_type'],
+            application_data.get('admin_message_id'),
+            application_data.get('admin_chat_id')
+        )
+    
+    @_db_op("Error adding client application", 0)
+    def add_client_application(self, cursor, application_data: Dict[str, Any]) -> int:
         """Добавляет заявку клиента и возвращает её ID"""
+        cursor.execute(self._INSERT_APPLICATION_SQL, self._application_row(application_data))
+        app_id = cursor.lastrowid
+        logger.info(f"Client application added with ID: {app_id}")
+        return app_id
+    
+    def add_client_applications_many(self, applications: List[Dict[str, Any]]) -> int:
+        """Добавляет несколько заявок клиентов одной транзакцией, возвращает их количество"""
+        if not applications:
+            return 0
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO client_applications 
-                    (user_id, direction, company_name, inn, bank, nds_rate, 
-                     category, payment_purpose, amount, equipment_type, 
-                     description, operation_type, admin_message_id, admin_chat_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    application_data['user_id'],
-                    application_data['direction'],
-                    application_data['company_name'],
-                    application_data['inn'],
-                    application_data['bank'],
-                    application_data['nds_rate'],
-                    application_data['category'],
-                    application_data['payment_purpose'],
-                    application_data['amount'],
-                    application_data['equipment_type'],
-                    application_data.get('description', ''),
-                    application_data['operation_type'],
-                    application_data.get('admin_message_id'),
-                    application_data.get('admin_chat_id')
-                ))
-                
-                conn.commit()
-                app_id = cursor.lastrowid
-                logger.info(f"Client application added with ID: {app_id}")
-                return app_id
-                
-        except Exception as e:
-            logger.error(f"Error adding client application: {e}")
+            # transaction(): вся пачка либо записывается, либо откатывается целиком
+            with self.transaction() as conn:
+                conn.executemany(self._INSERT_APPLICATION_SQL, (self._application_row(app) for app in applications))
+            logger.info(f"Added {len(applications)} client applications")
+            return len(applications)
+            
+        except sqlite3.Error as e:
+            logger.error(f"Error adding client applications: {e}")
             return 0
     
-    def get_client_application_by_id(self, app_id: int) -> Optional[Dict[str, Any]]:
+    @_db_op("Error getting client application", None)
+    def get_client_application_by_id(self, cursor, app_id: int) -> Optional[Dict[str, Any]]:
         """Получает заявку клиента по ID"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, user_id, direction, company_name, inn, bank, 
-                           nds_rate, category, payment_purpose, amount, 
-                           equipment_type, description, operation_type, 
-                           admin_message_id, admin_chat_id, created_at
-                    FROM client_applications WHERE id = ?
-                ''', (app_id,))
-                
-                row = cursor.fetchone()
-                if row:
-                    return {
-                        'id': row[0],
-                        'user_id': row[1],
-                        'direction': row[2],
-                        'company_name': row[3],
-                        'inn': row[4],
-                        'bank': row[5],
-                        'nds_rate': row[6],
-                        'category': row[7],
-                        'payment_purpose': row[8],
-                        'amount': row[9],
-                        'equipment_type': row[10],
-                        'description': row[11],
-                        'operation_type': row[12],
-                        'admin_message_id': row[13],
-                        'admin_chat_id': row[14],
-                        'created_at': row[15]
-                    }
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error getting client application: {e}")
-            return None
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('''
+            SELECT id, user_id, direction, company_name, inn, bank, 
+                   nds_rate, category, payment_purpose, amount, 
+                   equipment_type, description, operation_type, 
+                   admin_message_id, admin_chat_id, created_at
+            FROM client_applications WHERE id = ?
+        ''', (app_id,))
+        
+        row = cursor.fetchone()
+        return dict(row) if row else None
     
-    def update_client_application_admin_info(self, app_id: int, admin_message_id: int, admin_chat_id: str) -> bool:
+    @_db_op("Error updating client application")
+    def update_client_application_admin_info(self, cursor, app_id: int, admin_message_id: int, admin_chat_id: str) -> bool:
         """Обновляет информацию об админском сообщении для заявки"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE client_applications 
-                    SET admin_message_id = ?, admin_chat_id = ?
-                    WHERE id = ?
-                ''', (admin_message_id, admin_chat_id, app_id))
-                
-                conn.commit()
-                return cursor.rowcount > 0
-                
-        except Exception as e:
-            logger.error(f"Error updating client application: {e}")
-            return False
+        cursor.execute('''
+            UPDATE client_applications 
+            SET admin_message_id = ?, admin_chat_id = ?
+            WHERE id = ?
+        ''', (admin_message_id, admin_chat_id, app_id))
+        return cursor.rowcount > 0
     
-    def get_client_application_by_admin_message(self, admin_message_id: int, admin_chat_id: str) -> Optional[Dict[str, Any]]:
+    @_db_op("Error getting application by admin_message", None)
+    def get_client_application_by_admin_message(self, cursor, admin_message_id: int, admin_chat_id: str) -> Optional[Dict[str, Any]]:
         """Получает заявку клиента по admin_message_id и admin_chat_id"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, user_id, direction, company_name, inn, bank, 
-                           nds_rate, category, payment_purpose, amount, 
-                           equipment_type, description, operation_type, 
-                           admin_message_id, admin_chat_id, created_at
-                    FROM client_applications 
-                    WHERE admin_message_id = ? AND admin_chat_id = ?
-                ''', (admin_message_id, admin_chat_id))
-                
-                row = cursor.fetchone()
-                if row:
-                    return {
-                        'id': row[0],
-                        'user_id': row[1],
-                        'direction': row[2],
-                        'company_name': row[3],
-                        'inn': row[4],
-                        'bank': row[5],
-                        'nds_rate': row[6],
-                        'category': row[7],
-                        'payment_purpose': row[8],
-                        'amount': row[9],
-                        'equipment_type': row[10],
-                        'description': row[11],
-                        'operation_type': row[12],
-                        'admin_message_id': row[13],
-                        'admin_chat_id': row[14],
-                        'created_at': row[15]
-                    }
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error getting application by admin_message: {e}")
-            return None
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('''
+            SELECT id, user_id, direction, company_name, inn, bank, 
+                   nds_rate, category, payment_purpose, amount, 
+                   equipment_type, description, operation_type, 
+                   admin_message_id, admin_chat_id, created_at
+            FROM client_applications 
+            WHERE admin_message_id = ? AND admin_chat_id = ?
+        ''', (admin_message_id, admin_chat_id))
+        
+        row = cursor.fetchone()
+        return dict(row) if row else None
     
-    def add_owner_notification(self, notification_data: Dict[str, Any]) -> bool:
+    @_db_op("Error adding owner notification")
+    def add_owner_notification(self, cursor, notification_data: Dict[str, Any]) -> bool:
         """Добавляет уведомление для владельца"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO owner_notifications 
-                    (notification_type, user_id, application_id, offer_id, direction, 
-                     company_name, admin_chat_id, admin_user_id, feedback_type, message)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    notification_data['notification_type'],
-                    notification_data.get('user_id'),
-                    notification_data.get('application_id'),
-                    notification_data.get('offer_id'),
-                    notification_data.get('direction'),
-                    notification_data.get('company_name'),
-                    notification_data.get('admin_chat_id'),
-                    notification_data.get('admin_user_id'),
-                    notification_data.get('feedback_type'),
-                    notification_data.get('message')
-                ))
-                
-                conn.commit()
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error adding owner notification: {e}")
-            return False
+        cursor.execute('''
+            INSERT INTO owner_notifications 
+            (notification_type, user_id, application_id, offer_id, direction, 
+             company_name, admin_chat_id, admin_user_id, feedback_type, message)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            notification_data['notification_type'],
+            notification_data.get('user_id'),
+            notification_data.get('application_id'),
+            notification_data.get('offer_id'),
+            notification_data.get('direction'),
+            notification_data.get('company_name'),
+            notification_data.get('admin_chat_id'),
+            notification_data.get('admin_user_id'),
+            notification_data.get('feedback_type'),
+            notification_data.get('message')
+        ))
+        return True
     
-    def get_daily_statistics(self, date: str = None) -> Dict[str, Any]:
+    @_db_op("Error getting statistics", dict)
+    def get_daily_statistics(self, cursor, date: str = None) -> Dict[str, Any]:
         """Получает статистику за день"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                if date is None:
-                    date = datetime.now().strftime('%Y-%m-%d')
-                
-                # Статистика заявок
-                cursor.execute('''
-                    SELECT COUNT(*) FROM client_applications 
-                    WHERE DATE(created_at) = ?
-                ''', (date,))
-                applications_count = cursor.fetchone()[0]
-                
-                # Статистика обратной связи
-                cursor.execute('''
-                    SELECT feedback_type, COUNT(*) FROM feedback 
-                    WHERE DATE(created_at) = ?
-                    GROUP BY feedback_type
-                ''', (date,))
-                feedback_stats = dict(cursor.fetchall())
-                
-                # Статистика по направлениям
-                cursor.execute('''
-                    SELECT direction, COUNT(*) FROM client_applications 
-                    WHERE DATE(created_at) = ?
-                    GROUP BY direction
-                ''', (date,))
-                direction_stats = dict(cursor.fetchall())
-                
-                return {
-                    'date': date,
-                    'applications_count': applications_count,
-                    'feedback_stats': feedback_stats,
-                    'direction_stats': direction_stats
-                }
-                
-        except Exception as e:
-            logger.error(f"Error getting statistics: {e}")
-            return {}
+        if date is None:
+            date = datetime.now().strftime('%Y-%m-%d')
+        
+        # Полуоткрытый диапазон [date, date + 1 день) вместо DATE(created_at) = ?:
+        # created_at хранится как 'YYYY-MM-DD HH:MM:SS', и сравнение строк
+        # использует индексы по created_at вместо вычисления DATE() для каждой строки
+        next_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        day_range = (date, next_date)
+        
+        # Статистика по направлениям; общее число заявок - их сумма
+        cursor.execute('''
+            SELECT direction, COUNT(*) FROM client_applications 
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY direction
+        ''', day_range)
+        direction_stats = dict(cursor.fetchall())
+        applications_count = sum(direction_stats.values())
+        
+        # Статистика обратной связи
+        cursor.execute('''
+            SELECT feedback_type, COUNT(*) FROM feedback 
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY feedback_type
+        ''', day_range)
+        feedback_stats = dict(cursor.fetchall())
+        
+        return {
+            'date': date,
+            'applications_count': applications_count,
+            'feedback_stats': feedback_stats,
+            'direction_stats': direction_stats
+        }
     
     def get_directions(self) -> Dict[str, str]:
-        """Получает все направления"""
+        """Получает все направления (кэшируется до следующего add_direction)"""
+        directions = self._directions_cache
+        if directions is not None:
+            return dict(directions)
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT key, name FROM directions WHERE key != "другое"')
-                return {row[0]: row[1] for row in cursor.fetchall()}
-        except Exception as e:
+                directions = {row[0]: row[1] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
             logger.error(f"Error getting directions: {e}")
             return {}
+        
+        self._directions_cache = directions
+        return dict(directions)
+    
     
     
+    _INSERT_FEEDBACK_SQL = '''
+        INSERT INTO feedback 
+        (user_id, offer_id, feedback_type, direction, payment_purpose, 
+         amount, nds_rate, equipment_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
     
-    def add_feedback(self, feedback_data: Dict[str, Any]) -> bool:
+    @staticmethod
+    def _feedback_row(feedback_data: Dict[str, Any]) -> tuple:
+        return (
+            feedback_data['user_id'],
+            feedback_data['offer_id'],
+            feedback_data['feedback_type'],
+            feedback_data['direction'],
+            feedback_data.get('payment_purpose'),
+            feedback_data.get('amount'),
+            feedback_data.get('nds_rate'),
+            feedback_data.get('equipment_type')
+        )
+    
+    @_db_op("Error adding feedback")
+    def add_feedback(self, cursor, feedback_data: Dict[str, Any]) -> bool:
         """Добавляет обратную связь"""
+        cursor.execute(self._INSERT_FEEDBACK_SQL, self._feedback_row(feedback_data))
+        logger.info(f"Feedback added for user {feedback_data['user_id']}")
+        return True
+    
+    def add_feedbacks_many(self, feedbacks: List[Dict[str, Any]]) -> bool:
+        """Добавляет несколько отзывов одной транзакцией"""
+        if not feedbacks:
+            return True
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO feedback 
-                    (user_id, offer_id, feedback_type, direction, payment_purpose, 
-                     amount, nds_rate, equipment_type)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    feedback_data['user_id'],
-                    feedback_data['offer_id'],
-                    feedback_data['feedback_type'],
-                    feedback_data['direction'],
-                    feedback_data.get('payment_purpose'),
-                    feedback_data.get('amount'),
-                    feedback_data.get('nds_rate'),
-                    feedback_data.get('equipment_type')
-                ))
-                
-                conn.commit()
-                logger.info(f"Feedback added for user {feedback_data['user_id']}")
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error adding feedback: {e}")
+            # transaction(): вся пачка либо записывается, либо откатывается целиком
+            with self.transaction() as conn:
+                conn.executemany(self._INSERT_FEEDBACK_SQL, (self._feedback_row(fb) for fb in feedbacks))
+            return True
+            
+        except sqlite3.Error as e:
+            logger.error(f"Error adding feedbacks: {e}")
             return False
     
-    def add_or_update_user(self, user_data: Dict[str, Any]) -> bool:
+    # UPSERT вместо INSERT OR REPLACE: REPLACE удаляет строку целиком
+    # и сбрасывает is_blocked и first_seen
+    _UPSERT_USER_SQL = '''
+        INSERT INTO users (user_id, username, first_name, last_name, last_activity)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_name = excluded.last_name,
+            last_activity = excluded.last_activity
+    '''
+    
+    @staticmethod
+    def _user_row(user_data: Dict[str, Any]) -> tuple:
+        return (
+            user_data['user_id'],
+            user_data.get('username'),
+            user_data.get('first_name'),
+            user_data.get('last_name')
+        )
+    
+    @_db_op("Error adding user")
+    def add_or_update_user(self, cursor, user_data: Dict[str, Any]) -> bool:
         """Добавляет или обновляет пользователя"""
+        cursor.execute(self._UPSERT_USER_SQL, self._user_row(user_data))
+        return True
+
+    def add_or_update_users(self, users: List[Dict[str, Any]]) -> bool:
+        """Добавляет или обновляет нескольких пользователей одной транзакцией"""
+        if not users:
+            return True
+
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO users 
-                    (user_id, username, first_name, last_name, last_activity)
-                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (
-                    user_data['user_id'],
-                    user_data.get('username'),
-                    user_data.get('first_name'),
-                    user_data.get('last_name')
-                ))
-                
-                conn.commit()
+                cursor.executemany(self._UPSERT_USER_SQL, (self._user_row(user_data) for user_data in users))
                 return True
-                
-        except Exception as e:
-            logger.error(f"Error adding user: {e}")
+
+        except sqlite3.Error as e:
+            logger.error(f"Error adding users: {e}")
             return False
-    
+
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Получает всех пользователей"""
+        return self.get_users_page(limit=-1)
+    
+    def get_new_users(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Получает новых пользователей за последние N дней"""
+        return self.get_users_page(limit=-1, days=days)
+    
+    def iter_users(self, limit: int = -1, offset: int = 0, days: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Отдает пользователей по одному прямо из курсора (новые сначала).
+        
+        limit=-1 - без ограничения, days - только за последние N дней.
+        В отличие от остальных методов ошибки БД не глушатся, а пробрасываются.
+        """
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            if days is None:
                 cursor.execute('''
                     SELECT user_id, username, first_name, last_name, is_blocked, 
                            first_seen, last_activity
                     FROM users 
                     ORDER BY first_seen DESC
-                ''')
-                
-                users = []
-                for row in cursor.fetchall():
-                    users.append({
-                        'user_id': row[0],
-                        'username': row[1],
-                        'first_name': row[2],
-                        'last_name': row[3],
-                        'is_blocked': bool(row[4]),
-                        'first_seen': row[5],
-                        'last_activity': row[6]
-                    })
-                
-                return users
-                
-        except Exception as e:
-            logger.error(f"Error getting users: {e}")
-            return []
-    
-    def get_new_users(self, days: int = 7) -> List[Dict[str, Any]]:
-        """Получает новых пользователей за последние N дней"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+                    LIMIT ? OFFSET ?
+                ''', (limit, offset))
+            else:
                 cursor.execute('''
                     SELECT user_id, username, first_name, last_name, is_blocked, 
                            first_seen, last_activity
                     FROM users 
-                    WHERE first_seen >= datetime('now', '-{} days')
+                    WHERE first_seen >= datetime('now', ?)
                     ORDER BY first_seen DESC
-                '''.format(days))
-                
-                users = []
-                for row in cursor.fetchall():
-                    users.append({
-                        'user_id': row[0],
-                        'username': row[1],
-                        'first_name': row[2],
-                        'last_name': row[3],
-                        'is_blocked': bool(row[4]),
-                        'first_seen': row[5],
-                        'last_activity': row[6]
-                    })
-                
-                return users
-                
-        except Exception as e:
-            logger.error(f"Error getting new users: {e}")
+                    LIMIT ? OFFSET ?
+                ''', (f'-{int(days)} days', limit, offset))
+            
+            # is_blocked остается числом 0/1
+            for row in cursor:
+                yield dict(row)
+        finally:
+            # Брошенный на середине обход не должен держать снимок WAL открытым
+            cursor.close()
+    
+    def get_users_page(self, limit: int = 50, offset: int = 0, days: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Получает страницу пользователей (новые сначала); limit=-1 - без ограничения, days - только за последние N дней"""
+        try:
+            return list(self.iter_users(limit, offset, days))
+        except sqlite3.Error as e:
+            logger.error(f"Error getting users page: {e}")
             return []
     
-    def block_user(self, user_id: int) -> bool:
+    @staticmethod
+    def _set_user_blocked(cursor, user_id: int, blocked: int) -> bool:
+        """Ставит is_blocked; True, если пользователь есть (в том числе уже в нужном состоянии)"""
+        # Условие по is_blocked: повторное нажатие не пишет страницу и WAL
+        cursor.execute('''
+            UPDATE users SET is_blocked = ? WHERE user_id = ? AND is_blocked != ?
+        ''', (blocked, user_id, blocked))
+        if cursor.rowcount > 0:
+            return True
+        
+        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+        return cursor.fetchone() is not None
+    
+    @_db_op("Error blocking user")
+    def block_user(self, cursor, user_id: int) -> bool:
         """Блокирует пользователя"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users SET is_blocked = 1 WHERE user_id = ?
-                ''', (user_id,))
-                
-                conn.commit()
-                return cursor.rowcount > 0
-                
-        except Exception as e:
-            logger.error(f"Error blocking user: {e}")
-            return False
+        return self._set_user_blocked(cursor, user_id, 1)
     
-    def unblock_user(self, user_id: int) -> bool:
+    @_db_op("Error unblocking user")
+    def unblock_user(self, cursor, user_id: int) -> bool:
         """Разблокирует пользователя"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE users SET is_blocked = 0 WHERE user_id = ?
-                ''', (user_id,))
-                
-                conn.commit()
-                return cursor.rowcount > 0
-                
-        except Exception as e:
-            logger.error(f"Error unblocking user: {e}")
-            return False
+        return self._set_user_blocked(cursor, user_id, 0)
     
-    def is_user_blocked(self, user_id: int) -> bool:
+    @_db_op("Error checking user block status")
+    def is_user_blocked(self, cursor, user_id: int) -> bool:
         """Проверяет заблокирован ли пользователь"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
+        cursor.execute('''
+            SELECT is_blocked FROM users WHERE user_id = ?
+        ''', (user_id,))
+        
+        row = cursor.fetchone()
+        return bool(row[0]) if row else False
+    
+    @_db_op("Error getting blocked users", None)
+    def get_blocked_user_ids(self, cursor) -> Optional[Set[int]]:
+        """Получает id всех заблокированных пользователей (None при ошибке)"""
+        cursor.execute('''
+            SELECT user_id FROM users WHERE is_blocked = 1
+        ''')
+        
+        return {row[0] for row in cursor.fetchall()}
+    
+    @_db_op("Error saving session")
+    def set_session(self, cursor, key: str, value: str, expires_at: float) -> bool:
+        """Сохраняет значение сессии"""
+        cursor.execute('''
+            INSERT OR REPLACE INTO kv_sessions (key, value, expires_at)
+            VALUES (?, ?, ?)
+        ''', (key, value, expires_at))
+        return True
+    
+    @_db_op("Error getting session", None)
+    def get_session(self, cursor, key: str) -> Optional[str]:
+        """Получает значение сессии, если она не истекла"""
+        cursor.execute('''
+            SELECT value FROM kv_sessions WHERE key = ? AND expires_at > ?
+        ''', (key, time.time()))
+        
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    @_db_op("Error getting sessions", list)
+    def get_sessions(self, cursor, prefix: str) -> List[tuple]:
+        """Получает неистекшие сессии с ключами вида prefix:* как (key, value, expires_at)"""
+        # Диапазон по первичному ключу вместо LIKE: ';' идет сразу за ':'
+        cursor.execute('''
+            SELECT key, value, expires_at FROM kv_sessions
+            WHERE key >= ? AND key < ? AND expires_at > ?
+        ''', (f"{prefix}:", f"{prefix};", time.time()))
+        return cursor.fetchall()
+    
+    @_db_op("Error deleting session")
+    def delete_session(self, cursor, key: str) -> bool:
+        """Удаляет сессию"""
+        cursor.execute('DELETE FROM kv_sessions WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+    
+    @_db_op("Error cleaning up sessions", 0)
+    def cleanup_expired_sessions(self, cursor) -> int:
+        """Удаляет истекшие сессии"""
+        cursor.execute('DELETE FROM kv_sessions WHERE expires_at <= ?', (time.time(),))
+        return cursor.rowcount
+    
+    def _delete_in_batches(self, table: str, where: str, params: tuple, batch_size: int) -> int:
+        """Удаляет строки пачками по batch_size, каждая пачка - своя короткая транзакция.
+        
+        Так запись не блокируется надолго и WAL не разрастается на больших таблицах.
+        Пачка берет блокировку записи сразу (BEGIN IMMEDIATE), чтобы не получить
+        SQLITE_BUSY при повышении блокировки после чтения подзапроса.
+        """
+        deleted = 0
+        while True:
+            with self.transaction() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT is_blocked FROM users WHERE user_id = ?
-                ''', (user_id,))
-                
-                row = cursor.fetchone()
-                return bool(row[0]) if row else False
-                
-        except Exception as e:
-            logger.error(f"Error checking user block status: {e}")
-            return False
+                cursor.execute(f"""
+                    DELETE FROM {table}
+                    WHERE id IN (SELECT id FROM {table} WHERE {where} LIMIT ?)
+                """, (*params, batch_size))
+                batch_deleted = cursor.rowcount
+            
+            deleted += batch_deleted
+            if batch_deleted < batch_size:
+                return deleted
     
-    def cleanup_old_data(self, days_to_keep_notifications: int = 30, days_to_keep_feedback_no: int = 7) -> Dict[str, int]:
+    def cleanup_old_data(self, days_to_keep_notifications: int = 30, days_to_keep_feedback_no: int = 7,
+                         batch_size: int = 1000) -> Dict[str, int]:
         """Очищает старые данные из БД"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Дата для очистки уведомлений
-                notifications_cutoff = datetime.now() - timedelta(days=days_to_keep_notifications)
-                
-                # Дата для очистки отрицательных фидбеков
-                feedback_no_cutoff = datetime.now() - timedelta(days=days_to_keep_feedback_no)
-                
-                # 1. Удаляем старые уведомления владельцу
-                cursor.execute("""
-                    DELETE FROM owner_notifications 
-                    WHERE created_at < ?
-                """, (notifications_cutoff,))
-                notifications_deleted = cursor.rowcount
-                
-                # 2. Удаляем старые отрицательные фидбеки (только 'no')
-                cursor.execute("""
-                    DELETE FROM feedback 
-                    WHERE feedback_type = 'no' AND created_at < ?
-                """, (feedback_no_cutoff,))
-                feedback_no_deleted = cursor.rowcount
-                
-                # 3. Оставляем только положительные фидбеки (yes) - они не удаляются
-                # Это важно для статистики и аналитики
-                
-                conn.commit()
-                
-                logger.info(f"Cleanup completed:")
-                logger.info(f"  - Notifications deleted: {notifications_deleted}")
-                logger.info(f"  - Negative feedback deleted: {feedback_no_deleted}")
-                
-                return {
-                    'notifications_deleted': notifications_deleted,
-                    'feedback_no_deleted': feedback_no_deleted
-                }
-                
-        except Exception as e:
+            # Границы считает сам SQLite: created_at заполняется CURRENT_TIMESTAMP,
+            # datetime('now', '-N days') дает строку того же формата и тоже в UTC
+            
+            # 1. Удаляем старые уведомления владельцу
+            notifications_deleted = self._delete_in_batches(
+                'owner_notifications', "created_at < datetime('now', ?)",
+                (f'-{int(days_to_keep_notifications)} days',), batch_size
+            )
+            
+            # 2. Удаляем старые отрицательные фидбеки (только 'no')
+            feedback_no_deleted = self._delete_in_batches(
+                'feedback', "feedback_type = 'no' AND created_at < datetime('now', ?)",
+                (f'-{int(days_to_keep_feedback_no)} days',), batch_size
+            )
+            
+            # 3. Оставляем только положительные фидбеки (yes) - они не удаляются
+            # Это важно для статистики и аналитики
+            
+            logger.info(f"Cleanup completed:")
+            logger.info(f"  - Notifications deleted: {notifications_deleted}")
+            logger.info(f"  - Negative feedback deleted: {feedback_no_deleted}")
+            
+            return {
+                'notifications_deleted': notifications_deleted,
+                'feedback_no_deleted': feedback_no_deleted
+            }
+            
+        except sqlite3.Error as e:
             logger.error(f"Error during cleanup: {e}")
             return {'notifications_deleted': 0, 'feedback_no_deleted': 0}
     
-    def optimize_database(self) -> bool:
-        """Оптимизирует базу данных SQLite"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # 1. Включаем WAL режим для лучшей производительности
-                cursor.execute("PRAGMA journal_mode=WAL")
-                
-                # 2. Увеличиваем кэш страниц
-                cursor.execute("PRAGMA cache_size=10000")
-                
-                # 3. Включаем синхронизацию для надежности
-                cursor.execute("PRAGMA synchronous=NORMAL")
-                
-                # 4. Анализируем БД для оптимизации запросов
-                cursor.execute("ANALYZE")
-                
-                # 5. Выполняем очистку старых данных
-                cleanup_result = self.cleanup_old_data()
-                
-                conn.commit()
-                logger.info(f"Database optimization completed: {cleanup_result}")
-                return True
-                
-        except Exception as e:
-            logger.error(f"Error optimizing database: {e}")
-            return False
+    @_db_op("Error optimizing database")
+    def optimize_database(self, cursor, force: bool = False) -> bool:
+        """Оптимизирует базу данных SQLite (force=True - полный ANALYZE всех таблиц)"""
+        # WAL, synchronous и размер кэша уже заданы для каждого соединения в _connect()
+        # и init_database; здесь их не переопределяем (cache_size=10000 урезал бы кэш)
+        
+        # 1. Обновляем статистику планировщика: PRAGMA optimize анализирует
+        # только таблицы с устаревшей статистикой, ANALYZE - все подряд
+        cursor.execute("ANALYZE" if force else "PRAGMA optimize")
+        
+        # 2. Выполняем очистку старых данных
+        cleanup_result = self.cleanup_old_data()
+        logger.info(f"Database optimization completed: {cleanup_result}")
+        return True
     
-    def get_database_stats(self) -> Dict[str, Any]:
+    @_db_op("Error getting stats", dict)
+    def get_database_stats(self, cursor) -> Dict[str, Any]:
         """Получает статистику БД"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Подсчитываем записи
-                cursor.execute("SELECT COUNT(*) FROM client_applications")
-                applications = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM feedback WHERE feedback_type = 'yes'")
-                feedback_yes = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM feedback WHERE feedback_type = 'no'")
-                feedback_no = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM owner_notifications")
-                notifications = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM users")
-                users = cursor.fetchone()[0]
-                
-                # Размер БД
-                cursor.execute("SELECT page_count * page_size as size FROM pragma_page_count(), pragma_page_size()")
-                db_size = cursor.fetchone()[0]
-                
-                return {
-                    'applications': applications,
-                    'feedback_yes': feedback_yes,
-                    'feedback_no': feedback_no,
-                    'notifications': notifications,
-                    'users': users,
-                    'db_size_kb': db_size / 1024,
-                    'db_size_mb': db_size / (1024 * 1024)
-                }
-                
-        except Exception as e:
-            logger.error(f"Error getting stats: {e}")
-            return {}
+        # Все счетчики и размер БД одним запросом; отзывы yes/no считаются
+        # по индексу idx_feedback_type_created_at
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM client_applications),
+                (SELECT COUNT(*) FROM feedback WHERE feedback_type = 'yes'),
+                (SELECT COUNT(*) FROM feedback WHERE feedback_type = 'no'),
+                (SELECT COUNT(*) FROM owner_notifications),
+                (SELECT COUNT(*) FROM users),
+                (SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size())
+        ''')
+        applications, feedback_yes, feedback_no, notifications, users, db_size = cursor.fetchone()
+        
+        return {
+            'applications': applications,
+            'feedback_yes': feedback_yes,
+            'feedback_no': feedback_no,
+            'notifications': notifications,
+            'users': users,
+            'db_size_kb': db_size / 1024,
+            'db_size_mb': db_size / (1024 * 1024)
+        }
     
     
@@ -16,6 +16,30 @@ class UserStates:
     WAITING_APPLICATION = 'waiting_application'
 
 
+# Клавиатуры не меняются между вызовами (объекты telegram неизменяемы) - собираем один раз
+_START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💸 Отправляете перевод", callback_data="operation_send")],
+    [InlineKeyboardButton("💰 Получаете перевод", callback_data="operation_receive")]
+])
+
+_RESTART_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Начать заново", callback_data="restart")
+]])
+
+# DIRECTIONS задается в config и во время работы не меняется
+_DIRECTIONS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton(description, callback_data=f"direction_{direction}")]
+    for direction, description in DIRECTIONS.items()
+])
+
+# Текст формы заявки для каждой пары (операция, направление)
+_FORM_MESSAGES = {
+    (operation, direction): f"✅ Вы выбрали: {description}\n\n{form_text}"
+    for operation, form_text in (('send', APPLICATION_FORM_SEND), ('receive', APPLICATION_FORM_RECEIVE))
+    for direction, description in DIRECTIONS.items()
+}
+
+
 class UserHandler:
     """Обработчик пользовательских команд и действий"""
     
@@ -29,8 +53,7 @@ class UserHandler:
         user_id = update.effective_user.id
         
         # Очищаем предыдущее состояние пользователя
-        if user_id in self.user_states:
-            del self.user_states[user_id]
+        self.user_states.pop(user_id, None)
         
         welcome_message = """
 🤖 Добро пожаловать в бот заявок!
@@ -38,13 +61,8 @@ class UserHandler:
 Выберите тип операции:
         """
         
-        # Создаем inline клавиатуру с выбором типа операции
-        keyboard = [
-            [InlineKeyboardButton("💸 Отправляете перевод", callback_data="operation_send")],
-            [InlineKeyboardButton("💰 Получаете перевод", callback_data="operation_receive")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Inline клавиатура с выбором типа операции
+        reply_markup = _START_MARKUP
         
         # Если это callback query (кнопка "начать заново"), редактируем существующее сообщение
         if update.callback_query:
@@ -67,11 +85,11 @@ class UserHandler:
         operation = query.data.replace("operation_", "")
         logger.info(f"Выбрана операция: {operation}")
         
-        # Сохраняем тип операции в состоянии
-        if user_id not in self.user_states:
-            self.user_states[user_id] = {}
-        
-        self.user_states[user_id]['operation'] = operation
+        # Сохраняем тип операции в состоянии (user_states - SessionStore,
+        # измененный словарь присваиваем заново, чтобы он попал в БД)
+        user_state = self.user_states.get(user_id, {})
+        user_state['operation'] = operation
+        self.user_states[user_id] = user_state
         
         # Показываем выбор направления
         await self.show_direction_selection(update, context)
@@ -81,17 +99,9 @@ class UserHandler:
         query = update.callback_query
         await query.answer()
         
-        # Создаем inline клавиатуру с направлениями
-        keyboard = []
-        for direction, description in DIRECTIONS.items():
-            keyboard.append([InlineKeyboardButton(description, callback_data=f"direction_{direction}")])
-        
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await query.edit_message_text(
             "🏗️ Выберите направление:",
-            reply_markup=reply_markup
+            reply_markup=_DIRECTIONS_MARKUP
         )
     
     async def handle_direction_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -119,17 +129,9 @@ class UserHandler:
             'timestamp': time.time()
         }
         
-        # Определяем какая форма нужна
-        if operation == 'send':
-            form_text = APPLICATION_FORM_SEND
-        else:
-            form_text = APPLICATION_FORM_RECEIVE
-        
-        # Показываем форму заявки
+        # Показываем форму заявки (любая операция кроме send - форма получения)
         await query.edit_message_text(
-            f"✅ Вы выбрали: {DIRECTIONS[direction]}\n\n{form_text}",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Начать заново", callback_data="restart")
-            ]])
+            _FORM_MESSAGES['send' if operation == 'send' else 'receive', direction],
+            reply_markup=_RESTART_MARKUP
         )
     
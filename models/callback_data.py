@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Компактная упаковка callback_data для inline кнопок.
+
+Данные кнопки упаковываются через struct и кодируются в base64url с
+префиксом PACKED_PREFIX (его нет в алфавите base64url, поэтому такие
+кнопки не путаются со старыми строковыми вида "send_kp_1_2").
+Telegram ограничивает callback_data 64 байтами.
+"""
+
+import base64
+import binascii
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from config import DIRECTIONS
+
+PACKED_PREFIX = '~'
+
+# Максимум байт полезной нагрузки, чтобы base64 с префиксом уложился в 64 символа
+MAX_PAYLOAD_BYTES = (64 - len(PACKED_PREFIX)) * 3 // 4
+
+# Направления кодируются индексом в DIRECTIONS
+DIRECTION_KEYS = list(DIRECTIONS)
+DIRECTION_INDEX = {key: index for index, key in enumerate(DIRECTION_KEYS)}
+UNKNOWN_DIRECTION = 255
+
+
+class CallbackKind:
+    SEND_KP = 1
+    KP_PAGE = 2
+    FEEDBACK = 3
+
+
+_LAYOUTS = {
+    CallbackKind.SEND_KP: (struct.Struct('<iq'), ('offer_id', 'user_id')),
+    CallbackKind.KP_PAGE: (struct.Struct('<HBq'), ('page', 'direction', 'user_id')),
+    CallbackKind.FEEDBACK: (
+        struct.Struct('<BqiiB'),
+        ('feedback_type', 'admin_chat_id', 'kp_message_id', 'offer_id', 'direction')
+    ),
+}
+
+
+def encode_callback(kind: int, **fields: Any) -> str:
+    """Упаковывает поля кнопки в строку callback_data"""
+    layout, names = _LAYOUTS[kind]
+
+    if 'direction' in fields:
+        fields['direction'] = DIRECTION_INDEX.get(fields['direction'], UNKNOWN_DIRECTION)
+    if 'feedback_type' in fields:
+        fields['feedback_type'] = 1 if fields['feedback_type'] == 'yes' else 0
+    if 'offer_id' in fields:
+        fields['offer_id'] = fields['offer_id'] or 0
+
+    payload = bytes([kind]) + layout.pack(*(int(fields[name]) for name in names))
+
+    # Остаток лимита отдаем под название фирмы клиента (обрезаем по границе символа)
+    client = fields.get('client')
+    if client:
+        room = MAX_PAYLOAD_BYTES - len(payload)
+        payload += client.encode('utf-8')[:room].decode('utf-8', 'ignore').encode('utf-8')
+
+    return PACKED_PREFIX + base64.urlsafe_b64encode(payload).rstrip(b'=').decode('ascii')
+
+
+def decode_callback(data: str) -> Optional[Dict[str, Any]]:
+    """Распаковывает callback_data; возвращает None для неупакованных или битых данных"""
+    if not data or not data.startswith(PACKED_PREFIX):
+        return None
+
+    encoded = data[len(PACKED_PREFIX):]
+    try:
+        payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+    if not payload or payload[0] not in _LAYOUTS:
+        return None
+
+    kind = payload[0]
+    layout, names = _LAYOUTS[kind]
+    if len(payload) < 1 + layout.size:
+        return None
+
+    fields: Dict[str, Any] = dict(zip(names, layout.unpack_from(payload, 1)))
+    fields['kind'] = kind
+
+    if 'direction' in fields:
+        index = fields['direction']
+        fields['direction'] = DIRECTION_KEYS[index] if index < len(DIRECTION_KEYS) else 'unknown'
+    if 'feedback_type' in fields:
+        fields['feedback_type'] = 'yes' if fields['feedback_type'] else 'no'
+    if kind == CallbackKind.FEEDBACK:
+        fields['client'] = payload[1 + layout.size:].decode('utf-8', 'ignore')
+
+    return fields
+
+
+@dataclass(slots=True)
+class FeedbackCallback:
+    """Данные кнопки обратной связи по КП (упакованной или старого формата)"""
+    feedback_type: str
+    admin_chat_id: str
+    kp_message_id: str
+    offer_id: Optional[int]  # None - ручное КП от админа
+    direction: str
+    client: str
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> 'FeedbackCallback':
+        """Создает из результата decode_callback"""
+        return cls(
+            payload['feedback_type'],
+            str(payload['admin_chat_id']),
+            str(payload['kp_message_id']),
+            payload['offer_id'] or None,
+            payload['direction'],
+            payload['client'] or 'unk'
+        )
+
+    @classmethod
+    def parse_legacy(cls, data: str) -> Optional['FeedbackCallback']:
+        """Разбирает старый формат fb_yes/no_{admin_chat_id}_{message_id}_{offer_id}_{direction}_{client}"""
+        parts = data.split('_', 5)
+        if len(parts) < 6:
+            return None
+
+        _, feedback_type, admin_chat_id, kp_message_id, offer_id, rest = parts
+        # Ключи направлений сами содержат '_' (services_no_nds), поэтому направление
+        # ищется среди известных ключей (самое длинное совпадение), а не по разделителю
+        direction = max(
+            (key for key in DIRECTION_KEYS if rest == key or rest.startswith(key + '_')),
+            key=len, default=None
+        )
+        if direction is None:
+            direction, _, client = rest.partition('_')
+        else:
+            client = rest[len(direction) + 1:]
+        return cls(
+            feedback_type,
+            admin_chat_id,
+            kp_message_id,
+            int(offer_id) if offer_id.isdigit() else None,
+            direction,
+            client or 'unk'
+        )
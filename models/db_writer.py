@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Метка в очереди: все операции до нее записаны, задачу можно завершать
+_STOP = object()
+
+
+class DBWriter:
+    """Единственный писатель в SQLite.
+
+    Операции записи ставятся в очередь и выполняются пачками в отдельном
+    потоке: всё, что накопилось в очереди (до max_batch операций), пишется
+    одной транзакцией, а event loop не блокируется на fsync.
+    """
+
+    def __init__(self, db, max_batch: int = 64):
+        self.db = db
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запускает фоновую задачу записи"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, fn: Callable, *args: Any) -> asyncio.Future:
+        """Ставит операцию записи в очередь; результат можно дождаться через await"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, future))
+        return future
+
+    def post(self, fn: Callable, *args: Any) -> None:
+        """Ставит операцию записи в очередь без ожидания результата.
+
+        Future не создается: ошибка пачки только логируется и не превращается
+        в "Future exception was never retrieved" у вызывающего.
+        """
+        self.start()
+        self._queue.put_nowait((fn, args, None))
+
+    async def stop(self) -> None:
+        """Дописывает накопленные операции, дожидается задачи и освобождает поток записи"""
+        if self._task is not None:
+            # Метка остановки встает в очередь после всех уже поставленных операций,
+            # так что задача допишет их (и текущую пачку) и завершится сама
+            self._queue.put_nowait(_STOP)
+            await self._task
+            self._task = None
+
+        self._executor.shutdown(wait=True)
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._write_batch(batch)
+            if stopping:
+                return
+
+    async def _write_batch(self, batch: List[Tuple]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._execute, batch)
+        except Exception as e:
+            logger.error("Error writing batch of %d operations: %s", len(batch), e)
+            for _, _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    def _execute(self, batch: List[Tuple]) -> List[Any]:
+        with self.db.transaction():
+            return [fn(*args) for fn, args, _ in batch]
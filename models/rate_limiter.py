@@ -1,44 +1,58 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import math
 import time
-from collections import defaultdict
-from typing import Dict, List
+from collections import OrderedDict
+from typing import Tuple
 
 
 class RateLimiter:
-    """Система ограничения частоты запросов"""
-    
-    def __init__(self, max_requests: int = 10, time_window: int = 60):
+    """Система ограничения частоты запросов (token bucket)"""
+
+    def __init__(self, max_requests: int = 10, time_window: int = 60, maxsize: int = 100000):
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests: Dict[int, List[float]] = defaultdict(list)
-    
+        self.maxsize = maxsize
+        # Скорость пополнения: max_requests токенов за time_window секунд
+        self.rate = max_requests / time_window
+        # user_id -> (оставшиеся токены, время последнего пополнения), давно не писавшие - в начале.
+        # Вытесненный пользователь просто начнет с полного запаса токенов
+        self.state: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()
+
+    def _refill(self, user_id: int, current_time: float) -> float:
+        """Возвращает количество токенов пользователя на текущий момент"""
+        tokens, last_refill = self.state.get(user_id, (self.max_requests, current_time))
+        return min(self.max_requests, tokens + (current_time - last_refill) * self.rate)
+
     def is_allowed(self, user_id: int) -> bool:
         """Проверяет, разрешен ли запрос от пользователя"""
-        current_time = time.time()
-        user_requests = self.requests[user_id]
-        
-        # Удаляем старые запросы
-        user_requests[:] = [req_time for req_time in user_requests 
-                           if current_time - req_time < self.time_window]
-        
-        # Проверяем лимит
-        if len(user_requests) >= self.max_requests:
-            return False
-        
-        # Добавляем текущий запрос
-        user_requests.append(current_time)
-        return True
-    
+        current_time = time.monotonic()
+        tokens = self._refill(user_id, current_time)
+
+        # Проверяем лимит и списываем токен за текущий запрос
+        allowed = tokens >= 1
+        self._store(user_id, tokens - 1 if allowed else tokens, current_time)
+        return allowed
+
+    def _store(self, user_id: int, tokens: float, current_time: float) -> None:
+        self.state[user_id] = (tokens, current_time)
+        self.state.move_to_end(user_id)
+
+        # Спереди - давно не писавшие. За time_window запас пополняется полностью,
+        # так что такая запись ничем не отличается от отсутствующей и удаляется
+        idle_before = current_time - self.time_window
+        while self.state:
+            oldest_id = next(iter(self.state))
+            if len(self.state) <= self.maxsize and self.state[oldest_id][1] > idle_before:
+                break
+            del self.state[oldest_id]
+
     def get_remaining_time(self, user_id: int) -> int:
         """Возвращает время до следующего разрешенного запроса"""
-        current_time = time.time()
-        user_requests = self.requests[user_id]
-        
-        if len(user_requests) < self.max_requests:
+        tokens = self._refill(user_id, time.monotonic())
+
+        if tokens >= 1:
             return 0
-        
-        oldest_request = min(user_requests)
-        return int(self.time_window - (current_time - oldest_request))
 
+        return math.ceil((1 - tokens) / self.rate)
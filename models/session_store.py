@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import json
+import time
+from typing import Any, Dict, Optional
+
+from models.ttl_cache import TTLCache
+
+# Маркер отсутствующей сессии в кэше (чтобы не ходить в БД повторно)
+_MISSING = object()
+
+# Один энкодер на все записи: json.dumps с параметрами создает новый на каждый вызов
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+class SessionStore:
+    """Словарь состояний пользователей с TTL, сохраняемый в таблицу kv_sessions.
+
+    Значения кэшируются в памяти (LRU), изменения сразу пишутся в БД,
+    поэтому состояния переживают перезапуск бота. Значения должны
+    сериализоваться в JSON; после изменения вложенного словаря его нужно
+    присвоить заново, чтобы изменения попали в БД.
+
+    Если передан writer (DBWriter), запись и удаление уходят в его очередь
+    и не блокируют event loop; кэш при этом обновляется сразу, а если пачка
+    с последней записью ключа не записалась, ключ вытесняется из кэша.
+
+    После load() все сессии пространства уже в памяти и кэш считается полным:
+    промах означает отсутствие сессии, и get() не обращается к БД
+    (синхронное чтение из обработчика заблокировало бы event loop).
+    """
+
+    def __init__(self, db, namespace: str, ttl: int = 1800, maxsize: int = 100000, writer=None):
+        self.db = db
+        self.namespace = namespace
+        self.ttl = ttl
+        self.writer = writer
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+        self._loaded = False
+        # user_id -> последняя поставленная в очередь запись
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.namespace}:{user_id}"
+
+    def _write(self, user_id: int, fn, *args: Any) -> None:
+        if self.writer is None:
+            fn(*args)
+            return
+
+        future = self.writer.submit(fn, *args)
+        self._pending[user_id] = future
+        future.add_done_callback(functools.partial(self._write_done, user_id))
+
+    def _write_done(self, user_id: int, future: asyncio.Future) -> None:
+        # exception() заодно забирает ошибку, чтобы asyncio не писал "never retrieved"
+        failed = future.cancelled() or future.exception() is not None
+        if self._pending.get(user_id) is not future:
+            # Ключ уже записан заново - кэш отражает более новую запись
+            return
+
+        del self._pending[user_id]
+        if failed:
+            # Кэш опережал kv_sessions и разошелся бы с ней до перезапуска
+            self._cache.pop(user_id)
+
+    def load(self) -> None:
+        """Загружает все неистекшие сессии пространства в кэш (при запуске, до обработки обновлений)"""
+        now = time.time()
+        prefix_len = len(self.namespace) + 1
+        for key, raw, expires_at in self.db.get_sessions(self.namespace):
+            self._cache.set(int(key[prefix_len:]), json.loads(raw), ttl=expires_at - now)
+        self._loaded = True
+
+    def get(self, user_id: int, default: Optional[Any] = None) -> Any:
+        """Возвращает состояние пользователя"""
+        value = self._cache.get(user_id, _MISSING)
+        if value is _MISSING:
+            if self._loaded:
+                return default
+            raw = self.db.get_session(self._key(user_id))
+            value = json.loads(raw) if raw is not None else None
+            self._cache.set(user_id, value)
+        return default if value is None else value
+
+    def pop(self, user_id: int, default: Optional[Any] = None) -> Any:
+        """Удаляет состояние пользователя и возвращает его"""
+        value = self.get(user_id)
+        if value is None:
+            return default
+
+        self._cache.set(user_id, None)
+        self._write(user_id, self.db.delete_session, self._key(user_id))
+        return value
+
+    def __getitem__(self, user_id: int) -> Any:
+        value = self.get(user_id)
+        if value is None:
+            raise KeyError(user_id)
+        return value
+
+    def __setitem__(self, user_id: int, value: Any) -> None:
+        self._cache.set(user_id, value)
+        self._write(
+            user_id,
+            self.db.set_session,
+            self._key(user_id),
+            _encode_json(value),
+            time.time() + self.ttl
+        )
+
+    def __delitem__(self, user_id: int) -> None:
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
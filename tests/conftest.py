@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Общие фикстуры тестов
+"""
+
+import time
+
+import pytest
+
+
+class FakeClock:
+    """Управляемые time.time и time.monotonic"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'time', fake)
+    monkeypatch.setattr(time, 'monotonic', fake)
+    return fake
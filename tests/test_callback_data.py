@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты разбора callback_data старого формата
+"""
+
+import pytest
+
+from models.callback_data import FeedbackCallback
+
+
+@pytest.mark.parametrize('direction', ['spare_parts', 'services_nds', 'services_no_nds', 'goods_no_nds'])
+def test_parse_legacy_direction_with_underscores(direction):
+    callback = FeedbackCallback.parse_legacy(f"fb_yes_-100123_42_7_{direction}_ООО_Ромашка")
+
+    assert callback == FeedbackCallback('yes', '-100123', '42', 7, direction, 'ООО_Ромашка')
+
+
+def test_parse_legacy_simple_direction():
+    callback = FeedbackCallback.parse_legacy("fb_no_-100123_42_None_smr_Фирма")
+
+    assert callback == FeedbackCallback('no', '-100123', '42', None, 'smr', 'Фирма')
+
+
+def test_parse_legacy_without_client():
+    callback = FeedbackCallback.parse_legacy("fb_yes_-100123_42_7_services_no_nds")
+
+    assert callback.direction == 'services_no_nds'
+    assert callback.client == 'unk'
+
+
+def test_parse_legacy_unknown_direction():
+    callback = FeedbackCallback.parse_legacy("fb_yes_-100123_42_7_old_Фирма")
+
+    assert callback.direction == 'old'
+    assert callback.client == 'Фирма'
+
+
+def test_parse_legacy_too_short():
+    assert FeedbackCallback.parse_legacy("fb_yes_-100123_42") is None
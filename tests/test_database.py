@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты пакетной записи в KPDatabase
+"""
+
+import pytest
+
+from database import KPDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = KPDatabase(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def _count(db, table):
+    return db._get_conn().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def _offer(company, **fields):
+    return {'company_name': company, 'inn': '7700000000', 'direction': 'smr',
+            'payment_purpose': 'Оплата', 'bank': 'Банк', **fields}
+
+
+def test_add_ready_offers_many(db):
+    offers = [_offer('Альфа', min_amount=100, max_amount=200, commission=1.5), _offer('Бета')]
+
+    assert db.add_ready_offers_many(offers) == 2
+
+    rows = {offer['company_name']: offer for offer in db.get_ready_offers_by_direction('smr')}
+    assert set(rows) == {'Альфа', 'Бета'}
+    assert (rows['Альфа']['min_amount'], rows['Альфа']['max_amount'], rows['Альфа']['commission']) == (100, 200, 1.5)
+    assert (rows['Бета']['min_amount'], rows['Бета']['commission']) == (0, 0.0)
+
+
+def test_add_ready_offers_many_is_one_transaction(db):
+    # Вторая строка нарушает NOT NULL - первая тоже не должна остаться
+    assert db.add_ready_offers_many([_offer('Альфа'), _offer(None)]) == 0
+    assert _count(db, 'ready_offers') == 0
+
+
+def test_add_ready_offers_many_empty(db):
+    assert db.add_ready_offers_many([]) == 0
+
+
+def _feedback(user_id, **fields):
+    return {'user_id': user_id, 'offer_id': '1', 'feedback_type': 'yes', 'direction': 'smr', **fields}
+
+
+def test_add_feedbacks_many(db):
+    assert db.add_feedbacks_many([_feedback(1, amount=500), _feedback(2)])
+
+    rows = db._get_conn().execute('SELECT user_id, amount FROM feedback ORDER BY user_id').fetchall()
+    assert rows == [(1, 500), (2, None)]
+
+
+def test_add_feedbacks_many_is_one_transaction(db):
+    assert not db.add_feedbacks_many([_feedback(1), _feedback(2, feedback_type=None)])
+    assert _count(db, 'feedback') == 0
+
+
+def _application(user_id, **fields):
+    return {'user_id': user_id, 'direction': 'smr', 'company_name': 'Альфа', 'inn': '7700000000',
+            'bank': 'Банк', 'nds_rate': 20, 'category': 'Товары', 'payment_purpose': 'Оплата',
+            'amount': 1000, 'equipment_type': '-', 'operation_type': 'send', **fields}
+
+
+def test_add_client_applications_many(db):
+    applications = [_application(1, description='Срочно'), _application(2, admin_message_id=7, admin_chat_id='-100')]
+
+    assert db.add_client_applications_many(applications) == 2
+
+    first, second = db.get_client_application_by_id(1), db.get_client_application_by_id(2)
+    assert (first['user_id'], first['description'], first['admin_message_id']) == (1, 'Срочно', None)
+    assert (second['description'], second['admin_message_id'], second['admin_chat_id']) == ('', 7, '-100')
+
+
+def test_add_client_applications_many_is_one_transaction(db):
+    assert db.add_client_applications_many([_application(1), _application(2, inn=None)]) == 0
+    assert _count(db, 'client_applications') == 0
+
+
+def _purposes(db):
+    return db._get_conn().execute('SELECT direction_key, purpose FROM payment_purposes ORDER BY id').fetchall()
+
+
+def test_add_payment_purposes(db):
+    db.add_direction('smr', 'СМР')
+
+    assert db.add_payment_purposes('smr', (purpose for purpose in ['Аванс', 'Оплата']))
+    assert _purposes(db) == [('smr', 'Аванс'), ('smr', 'Оплата')]
+
+
+def test_add_payment_purposes_unknown_direction(db):
+    # foreign_keys=ON: назначения без направления не добавляются
+    assert not db.add_payment_purposes('nope', ['Аванс'])
+    assert not db.add_payment_purpose('nope', 'Аванс')
+    assert _purposes(db) == []
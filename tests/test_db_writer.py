@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты очереди записи DBWriter
+"""
+
+import asyncio
+from contextlib import contextmanager
+
+import pytest
+
+from models.db_writer import DBWriter
+
+
+class FakeDB:
+    """Считает транзакции и записывает выполненные операции"""
+
+    def __init__(self):
+        self.transactions = 0
+        self.written = []
+
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        yield
+
+    def write(self, value):
+        self.written.append(value)
+        return value * 10
+
+    def fail(self, value):
+        raise RuntimeError(f"cannot write {value}")
+
+
+def test_queued_operations_are_written_in_one_batch():
+    db = FakeDB()
+
+    async def main():
+        writer = DBWriter(db)
+        futures = [writer.submit(db.write, value) for value in range(5)]
+        results = await asyncio.gather(*futures)
+        await writer.stop()
+        return results
+
+    assert asyncio.run(main()) == [0, 10, 20, 30, 40]
+    assert db.written == [0, 1, 2, 3, 4]
+    assert db.transactions == 1
+
+
+def test_batch_size_is_limited():
+    db = FakeDB()
+
+    async def main():
+        writer = DBWriter(db, max_batch=2)
+        await asyncio.gather(*(writer.submit(db.write, value) for value in range(5)))
+        await writer.stop()
+
+    asyncio.run(main())
+    assert db.written == [0, 1, 2, 3, 4]
+    assert db.transactions == 3
+
+
+def test_stop_drains_queue():
+    db = FakeDB()
+
+    async def main():
+        writer = DBWriter(db)
+        for value in range(10):
+            writer.post(db.write, value)
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(main())
+    assert db.written == list(range(10))
+    # Поток записи освобожден
+    with pytest.raises(RuntimeError):
+        writer._executor.submit(print)
+
+
+def test_failed_batch_is_reported_to_submitters():
+    db = FakeDB()
+
+    async def main():
+        writer = DBWriter(db)
+        writer.post(db.write, 1)
+        future = writer.submit(db.fail, 2)
+        with pytest.raises(RuntimeError):
+            await future
+        # Следующие пачки пишутся как обычно
+        assert await writer.submit(db.write, 3) == 30
+        await writer.stop()
+
+    asyncio.run(main())
+    assert db.written == [1, 3]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты RateLimiter (token bucket)
+"""
+
+from models.rate_limiter import RateLimiter
+
+
+def test_limit_and_refill(clock):
+    limiter = RateLimiter(max_requests=2, time_window=10)
+
+    assert limiter.is_allowed(1)
+    assert limiter.is_allowed(1)
+    assert not limiter.is_allowed(1)
+    # Токен пополняется за time_window / max_requests секунд
+    assert limiter.get_remaining_time(1) == 5
+    assert limiter.is_allowed(2)
+
+    clock.advance(5)
+    assert limiter.get_remaining_time(1) == 0
+    assert limiter.is_allowed(1)
+    assert not limiter.is_allowed(1)
+
+
+def test_refill_is_capped(clock):
+    limiter = RateLimiter(max_requests=2, time_window=10)
+    limiter.is_allowed(1)
+
+    clock.advance(1000)
+    assert limiter.is_allowed(1)
+    assert limiter.is_allowed(1)
+    assert not limiter.is_allowed(1)
+
+
+def test_idle_users_are_evicted(clock):
+    limiter = RateLimiter(max_requests=2, time_window=10)
+    limiter.is_allowed(1)
+
+    clock.advance(5)
+    limiter.is_allowed(2)
+    assert set(limiter.state) == {1, 2}
+
+    clock.advance(6)
+    limiter.is_allowed(3)
+    assert set(limiter.state) == {2, 3}
+
+
+def test_state_is_bounded(clock):
+    limiter = RateLimiter(max_requests=2, time_window=10, maxsize=2)
+    for user_id in range(5):
+        limiter.is_allowed(user_id)
+
+    assert list(limiter.state) == [3, 4]
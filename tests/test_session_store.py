@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты SessionStore и TTLCache
+"""
+
+import asyncio
+
+import pytest
+
+from database import KPDatabase
+from models.session_store import SessionStore
+from models.ttl_cache import TTLCache
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = KPDatabase(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def test_ttl_cache_expiry(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=30)
+
+    clock.advance(11)
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+    clock.advance(20)
+    assert cache.get('b') is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(ttl=10, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_session_persists_between_stores(db):
+    SessionStore(db, 'state')[1] = {'step': 'form'}
+
+    assert SessionStore(db, 'state')[1] == {'step': 'form'}
+    assert 1 not in SessionStore(db, 'other')
+
+
+def test_session_expires(db, clock):
+    store = SessionStore(db, 'state', ttl=60)
+    store[1] = {'step': 'form'}
+
+    clock.advance(61)
+    assert store.get(1) is None
+    assert SessionStore(db, 'state').get(1) is None
+
+
+def test_pop_removes_session(db):
+    store = SessionStore(db, 'state')
+    store[1] = {'step': 'form'}
+
+    assert store.pop(1) == {'step': 'form'}
+    assert store.pop(1, 'none') == 'none'
+    assert SessionStore(db, 'state').get(1) is None
+    with pytest.raises(KeyError):
+        del store[1]
+
+
+def test_load_keeps_remaining_ttl(db, clock):
+    SessionStore(db, 'state', ttl=60)[1] = {'step': 'form'}
+    clock.advance(50)
+
+    store = SessionStore(db, 'state', ttl=60)
+    store.load()
+    assert store[1] == {'step': 'form'}
+
+    clock.advance(11)
+    assert 1 not in store
+
+
+def test_miss_after_load_does_not_read_db(db):
+    store = SessionStore(db, 'state')
+    store.load()
+    # Сессия, появившаяся в БД после load(), не читается: промах - это отсутствие сессии
+    SessionStore(db, 'state')[2] = {'step': 'form'}
+    db.get_session = None
+
+    assert store.get(2, 'none') == 'none'
+    assert 2 not in store
+
+
+class FakeWriter:
+    """Очередь записи, результаты которой задает тест"""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.futures.append(future)
+        return future
+
+
+def test_failed_write_evicts_key(db):
+    async def main():
+        writer = FakeWriter()
+        store = SessionStore(db, 'state', writer=writer)
+        store.load()
+        store[1] = {'step': 'form'}
+        store[2] = {'step': 'form'}
+
+        writer.futures[0].set_exception(RuntimeError('disk I/O error'))
+        writer.futures[1].set_result(True)
+        await asyncio.sleep(0)
+        return store
+
+    store = asyncio.run(main())
+    assert 1 not in store
+    assert store[2] == {'step': 'form'}
+
+
+def test_failed_stale_write_keeps_newer_value(db):
+    async def main():
+        writer = FakeWriter()
+        store = SessionStore(db, 'state', writer=writer)
+        store.load()
+        store[1] = {'step': 'old'}
+        store[1] = {'step': 'new'}
+
+        writer.futures[0].set_exception(RuntimeError('disk I/O error'))
+        await asyncio.sleep(0)
+        return store
+
+    assert asyncio.run(main())[1] == {'step': 'new'}